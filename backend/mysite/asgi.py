@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
+# Read by settings to pick ASGI-safe database connection defaults
+os.environ.setdefault('SERVER_INTERFACE', 'asgi')
 
 application = get_asgi_application()
@@ -0,0 +1,35 @@
+"""
+API documentation (drf_yasg).
+
+Imported lazily, on the first docs request or by `manage.py generate_schema`,
+so workers boot without loading drf_yasg. The UIs load the precomputed schema
+from mysite.schema instead of introspecting the API on every hit.
+"""
+from django.conf import settings
+from drf_yasg import openapi
+from drf_yasg.codecs import OpenAPICodecJson
+from drf_yasg.generators import OpenAPISchemaGenerator
+from drf_yasg.views import get_schema_view
+from rest_framework import permissions
+
+info = openapi.Info(
+    title="Trip Management API",
+    default_version='v1',
+    description="API documentation for trip management system",
+)
+
+schema_view = get_schema_view(
+    info,
+    public=True,
+    permission_classes=[permissions.AllowAny],
+)
+
+# The UI pages only hold the viewer; the schema itself comes from SPEC_URL
+swagger_ui = schema_view.with_ui('swagger', cache_timeout=settings.DOCS_UI_CACHE_TIMEOUT)
+redoc_ui = schema_view.with_ui('redoc', cache_timeout=settings.DOCS_UI_CACHE_TIMEOUT)
+
+
+def generate_schema():
+    """The OpenAPI schema of every public endpoint, as JSON bytes."""
+    schema = OpenAPISchemaGenerator(info).get_schema(request=None, public=True)
+    return OpenAPICodecJson(validators=[]).encode(schema)
@@ -0,0 +1,45 @@
+"""
+Serves the OpenAPI schema written by `manage.py generate_schema`.
+
+The file is read once per process and served with an ETag, so clients and
+proxies revalidate with a 304 instead of downloading it again. Without the
+file (e.g. in development) the schema is generated on the first request.
+"""
+import hashlib
+import logging
+import threading
+from django.conf import settings
+from django.http import HttpResponse
+from django.views.decorators.http import condition, require_GET
+
+logger = logging.getLogger("django")
+
+_schema = None
+_lock = threading.Lock()
+
+
+def load_schema():
+    """Returns (JSON bytes, ETag) of the schema, loading it on first use."""
+    global _schema
+    if _schema is None:
+        with _lock:
+            if _schema is None:
+                try:
+                    with open(settings.OPENAPI_SCHEMA_PATH, "rb") as f:
+                        content = f.read()
+                except FileNotFoundError:
+                    logger.warning(f"{settings.OPENAPI_SCHEMA_PATH} not found; generating the schema. "
+                                   f"Run `manage.py generate_schema` at build time to skip this.")
+                    from .docs import generate_schema
+                    content = generate_schema()
+                _schema = (content, f'"{hashlib.sha256(content).hexdigest()[:32]}"')
+    return _schema
+
+
+@require_GET
+@condition(etag_func=lambda request: load_schema()[1])
+def openapi_schema(request):
+    content, _ = load_schema()
+    response = HttpResponse(content, content_type="application/json")
+    response["Cache-Control"] = f"public, max-age={settings.OPENAPI_SCHEMA_MAX_AGE}"
+    return response
@@ -16,26 +16,24 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
-from drf_yasg import openapi
-from drf_yasg.views import get_schema_view
-from rest_framework import permissions
+from .schema import openapi_schema
 
 
-schema_view = get_schema_view(
-    openapi.Info(
-        title="Trip Management API",
-        default_version='v1',
-        description="API documentation for trip management system",
-    ),
-    public=True,
-    permission_classes=[permissions.AllowAny],
-)
+def api_docs(request, *args, **kwargs):
+    # drf_yasg is imported on the first docs request, not when a worker boots
+    from .docs import swagger_ui
+    return swagger_ui(request, *args, **kwargs)
+
+
+def api_redoc(request, *args, **kwargs):
+    from .docs import redoc_ui
+    return redoc_ui(request, *args, **kwargs)
+
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('trips.urls')),
-    path('api/docs/', schema_view.with_ui('swagger',
-         cache_timeout=0), name='api-docs'),
-    path('api/redoc/', schema_view.with_ui('redoc',
-         cache_timeout=0), name='api-redoc'),
+    path('api/schema.json', openapi_schema, name='api-schema'),
+    path('api/docs/', api_docs, name='api-docs'),
+    path('api/redoc/', api_redoc, name='api-redoc'),
 ]
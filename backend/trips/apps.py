@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class TripsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'trips'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from .metrics import instrument_connection
+        connection_created.connect(instrument_connection, dispatch_uid="trips.metrics.instrument_connection")
+        from . import signals
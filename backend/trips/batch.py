@@ -0,0 +1,190 @@
+"""
+Batch trip planning: many trip specs in one request.
+
+Work shared between trips is done once: every distinct address is geocoded
+once and every distinct lane (start, pickup, extra stops, dropoff) is routed
+and given stops once, on a bounded pool. All trips, logs, routes and stops are then written
+with one bulk insert per table.
+"""
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import connection, transaction
+from .models import DriverLog as Log, Route, Stop, Trip
+from .ledger import LEDGER_FIELDS, add_duty, apply_cycle_hours, lock_drivers
+from .metrics import submit_with_context, timed
+from .planning import build_logs, build_stops, route_fields, route_payload
+from .serializers import TripSerializer, LogSerializer
+from .routing import get_route
+from .services import _lane_key, calculate_stops, calculate_trip_details, compliance_violations, geocode_location
+
+logger = logging.getLogger("django")
+
+LOCATION_FIELDS = ("current_location", "pickup_location", "dropoff_location")
+COORDINATE_PATTERN = re.compile(r"^\s*-?\d+(\.\d+)?\s*,\s*-?\d+(\.\d+)?\s*$")
+
+
+def plan_batch(specs, geometry_options, refresh=False):
+    """
+    Plans and saves a list of trip specs (create_trip request bodies).
+
+    Locations may be "lon,lat" coordinates or addresses; addresses are
+    geocoded and the trip is saved with the coordinates.
+
+    Trips with a driver are scheduled with the driver's ledger read under its
+    row lock, after the duty days of that driver's earlier trips in the batch.
+
+    Returns:
+        list: one result per spec, in order. Planned trips get
+        ``status: "created"`` plus the create_trip response; a spec that is
+        invalid, cannot be geocoded or has no route gets ``status: "failed"``
+        with ``errors`` or ``error``, without affecting the others.
+    """
+    results = [None] * len(specs)
+    pending = {}
+    for i, spec in enumerate(specs):
+        serializer = TripSerializer(data=spec)
+        if serializer.is_valid():
+            pending[i] = dict(serializer.validated_data)
+        else:
+            results[i] = {"index": i, "status": "failed", "errors": serializer.errors}
+
+    with ThreadPoolExecutor(max_workers=settings.BATCH_PLANNING_WORKERS,
+                            thread_name_prefix="batch-planner") as executor:
+        addresses = {location for data in pending.values() for location in _lane(data)
+                     if not COORDINATE_PATTERN.match(location)}
+        with timed("geocoding"):
+            coordinates = _map_unique(executor, geocode_location, addresses)
+        for i, data in list(pending.items()):
+            unresolved = [location for location in _lane(data)
+                          if location in coordinates and not coordinates[location]]
+            if unresolved:
+                results[i] = _failed(i, f"Could not geocode: {', '.join(unresolved)}")
+                del pending[i]
+                continue
+            for field in LOCATION_FIELDS:
+                data[field] = coordinates.get(data[field], data[field])
+            data["waypoints"] = [coordinates.get(point, point) for point in data.get("waypoints") or []]
+
+        lanes = {_lane_key(*_lane(data)): _lane(data) for data in pending.values()}
+        with timed("lanes"):
+            plans = _map_unique(executor, lambda lane: _plan_lane(lane, refresh), lanes)
+
+    planned = []
+    for i, data in pending.items():
+        plan = plans[_lane_key(*_lane(data))]
+        if plan is None:
+            results[i] = _failed(i, "No route found between the trip locations")
+        else:
+            planned.append((i, data, plan))
+
+    for i, payload in _save_planned(planned, geometry_options):
+        results[i] = {"index": i, "status": "created", **payload}
+    return results
+
+
+def _lane(data):
+    current, pickup, dropoff = (data[field] for field in LOCATION_FIELDS)
+    return (current, pickup, *(data.get("waypoints") or ()), dropoff)
+
+
+def _failed(index, error):
+    return {"index": index, "status": "failed", "error": error}
+
+
+def _map_unique(executor, fetch, keys):
+    """Runs ``fetch`` once per key on the executor; returns {key: result}, None for failures."""
+    if isinstance(keys, dict):
+        items = list(keys.items())
+    else:
+        items = [(key, key) for key in keys]
+    futures = [(key, submit_with_context(executor, _in_worker, fetch, argument))
+               for key, argument in items]
+
+    results = {}
+    for key, future in futures:
+        try:
+            results[key] = future.result()
+        except Exception as e:
+            logger.error(f"Batch lookup for {key} failed: {e}")
+            results[key] = None
+    return results
+
+
+def _in_worker(fetch, argument):
+    try:
+        return fetch(argument)
+    finally:
+        # Pool threads open their own connections (lookup caches); don't leak them
+        connection.close()
+
+
+def _plan_lane(lane, refresh):
+    route_data = get_route(list(lane), refresh=refresh)
+    if route_data is None:
+        return None
+    # Depends on the route only, so it is shared by every trip on the lane
+    driving_hours, total_hours, total_miles = calculate_trip_details(route_data, None)
+    if driving_hours is None:
+        return None
+    geometry = route_data["routes"][0]["geometry"]
+    _, _, fuel_locations, rest_locations = calculate_stops(total_miles, total_hours, geometry,
+                                                           route_data["routes"][0].get("legs"))
+    return {
+        "geometry": geometry,
+        "driving_hours": driving_hours,
+        "total_hours": total_hours,
+        "total_miles": total_miles,
+        "fuel_locations": fuel_locations,
+        "rest_locations": rest_locations,
+    }
+
+
+def _save_planned(planned, geometry_options):
+    """Bulk-inserts the planned trips with their logs, routes and stops; returns (index, payload) pairs."""
+    if not planned:
+        return []
+
+    with transaction.atomic():
+        with timed("hos"):
+            drivers = lock_drivers({data["driver"].id for _, data, _ in planned if data.get("driver")})
+            trips, logs = [], []
+            for _, data, plan in planned:
+                trip = Trip(**data)
+                driver = drivers.get(trip.driver_id)
+                first_day = None
+                if driver is not None:
+                    # Scheduled after the duty days of the driver's earlier trips in the batch
+                    first_day = apply_cycle_hours(trip, driver)
+                trip_logs = build_logs(trip, plan["driving_hours"], first_day)
+                if driver is not None:
+                    add_duty(driver, trip_logs)
+                trip.violations = compliance_violations(trip_logs)
+                trips.append(trip)
+                logs.append(trip_logs)
+
+        with timed("db_write"):
+            Trip.objects.bulk_create(trips)
+            Log.objects.bulk_create([log for trip_logs in logs for log in trip_logs])
+            for driver in drivers.values():
+                driver.save(update_fields=LEDGER_FIELDS)
+            routes = Route.objects.bulk_create([
+                Route(**route_fields(trip, plan["geometry"], plan["driving_hours"], plan["total_hours"],
+                                     plan["total_miles"]))
+                for trip, (_, _, plan) in zip(trips, planned)
+            ])
+            stops = [build_stops(route, plan["fuel_locations"], plan["rest_locations"])
+                     for route, (_, _, plan) in zip(routes, planned)]
+            Stop.objects.bulk_create([stop for route_stops in stops for stop in route_stops])
+
+    with timed("serialize"):
+        return [
+            (i, {
+                "trip": TripSerializer(trip).data,
+                **route_payload(route, route_stops, geometry_options, geometry=plan["geometry"]),
+                "logs": LogSerializer(trip_logs, many=True).data,
+            })
+            for (i, _, plan), trip, trip_logs, route, route_stops in zip(planned, trips, logs, routes, stops)
+        ]
+
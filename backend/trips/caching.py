@@ -0,0 +1,260 @@
+import hashlib
+import logging
+import threading
+import time
+from datetime import timedelta
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+from .models import LookupCacheEntry, Trip
+
+logger = logging.getLogger("django")
+
+
+def normalize_place(text):
+    """Case- and whitespace-insensitive form of a free-text location."""
+    return " ".join(str(text).casefold().split())
+
+
+def normalize_coordinate(coordinate, precision):
+    """
+    Round a "lon,lat" string or (lon, lat) pair to ``precision`` decimals.
+
+    Anything that does not parse as a coordinate pair is treated as a place name.
+    """
+    try:
+        if isinstance(coordinate, str):
+            lon, lat = (float(part) for part in coordinate.split(","))
+        else:
+            lon, lat = (float(part) for part in coordinate)
+    except (TypeError, ValueError):
+        return normalize_place(coordinate)
+
+    # "+ 0.0" folds -0.0 into 0.0 so both round to the same key
+    return f"{round(lon, precision) + 0.0:.{precision}f},{round(lat, precision) + 0.0:.{precision}f}"
+
+
+class LookupCache:
+    """
+    Persistent, cross-process cache for external lookups, backed by LookupCacheEntry.
+
+    Entries expire ``ttl`` seconds after they were fetched. Once the namespace
+    holds more than ``max_entries`` rows the least recently used ones are
+    evicted. Each entry counts its own hits and misses (fetches), so stats()
+    needs no extra bookkeeping writes. Hits are counted in memory and written
+    at most every LOOKUP_CACHE_HIT_FLUSH seconds, so a cache hit is a single
+    read. Database errors are logged and treated as misses so a cache outage
+    never breaks the lookup itself.
+    """
+
+    def __init__(self, namespace, ttl, max_entries):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._pending_hits = {}  # digest -> hits not yet written
+        self._flushed_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _digest(self, query):
+        return hashlib.sha1(f"{self.namespace}:{query}".encode()).hexdigest()
+
+    def get(self, query):
+        """Returns the cached value for a normalized query, or None."""
+        now = timezone.now()
+        try:
+            entry = (LookupCacheEntry.objects
+                     .filter(key=self._digest(query), fetched_at__gte=now - timedelta(seconds=self.ttl))
+                     .only("id", "value")
+                     .first())
+        except DatabaseError as e:
+            logger.error(f"Lookup cache read failed for {self.namespace}: {e}")
+            return None
+        if entry is None:
+            return None
+        self._count_hits([self._digest(query)])
+        return entry.value
+
+    def get_many(self, queries):
+        """get() for several queries with one read; returns values in order, None for misses."""
+        now = timezone.now()
+        digests = [self._digest(query) for query in queries]
+        try:
+            values = dict(LookupCacheEntry.objects
+                          .filter(key__in=set(digests), fetched_at__gte=now - timedelta(seconds=self.ttl))
+                          .values_list("key", "value"))
+        except DatabaseError as e:
+            logger.error(f"Lookup cache read failed for {self.namespace}: {e}")
+            return [None] * len(queries)
+        self._count_hits(list(values))
+        return [values.get(digest) for digest in digests]
+
+    def _count_hits(self, digests):
+        with self._lock:
+            for digest in digests:
+                self._pending_hits[digest] = self._pending_hits.get(digest, 0) + 1
+            due = time.monotonic() - self._flushed_at >= settings.LOOKUP_CACHE_HIT_FLUSH
+        if due:
+            self.flush_hits()
+
+    def flush_hits(self):
+        """Writes the hits counted since the last flush: one UPDATE per distinct count."""
+        with self._lock:
+            pending, self._pending_hits = self._pending_hits, {}
+            self._flushed_at = time.monotonic()
+        by_count = {}
+        for digest, hits in pending.items():
+            by_count.setdefault(hits, []).append(digest)
+        now = timezone.now()
+        try:
+            # A savepoint, so a failure here never breaks the caller's transaction
+            with transaction.atomic():
+                for hits, digests in by_count.items():
+                    LookupCacheEntry.objects.filter(key__in=digests).update(
+                        hits=F("hits") + hits, last_used_at=now)
+        except DatabaseError as e:
+            logger.error(f"Lookup cache hit update failed for {self.namespace}: {e}")
+
+    def set(self, query, value):
+        now = timezone.now()
+        try:
+            updated = LookupCacheEntry.objects.filter(key=self._digest(query)).update(
+                value=value, misses=F("misses") + 1, fetched_at=now, last_used_at=now)
+            if not updated:
+                # In a savepoint, so losing the race below leaves the caller's transaction usable
+                with transaction.atomic():
+                    LookupCacheEntry.objects.create(
+                        namespace=self.namespace, key=self._digest(query), query=query,
+                        value=value, misses=1, fetched_at=now, last_used_at=now)
+                self._evict()
+        except IntegrityError:
+            pass  # another worker stored the same lookup first
+        except DatabaseError as e:
+            logger.error(f"Lookup cache write failed for {self.namespace}: {e}")
+
+    def set_many(self, items):
+        """set() for several (query, value) pairs in a few bulk queries; replaced entries restart their counts."""
+        now = timezone.now()
+        entries = {self._digest(query): (query, value) for query, value in items}
+        if not entries:
+            return
+        try:
+            with transaction.atomic():
+                LookupCacheEntry.objects.filter(key__in=list(entries)).delete()
+                LookupCacheEntry.objects.bulk_create([
+                    LookupCacheEntry(namespace=self.namespace, key=key, query=query, value=value,
+                                     misses=1, fetched_at=now, last_used_at=now)
+                    for key, (query, value) in entries.items()
+                ], ignore_conflicts=True)
+            self._evict()
+        except DatabaseError as e:
+            logger.error(f"Lookup cache write failed for {self.namespace}: {e}")
+
+    def get_or_fetch(self, query, fetch, refresh=False):
+        """
+        Returns the cached value for ``query`` or calls ``fetch()`` and stores
+        its result. ``None`` results are never cached; ``refresh`` skips the read.
+        """
+        value = None if refresh else self.get(query)
+        if value is not None:
+            return value
+
+        value = fetch()
+        if value is not None:
+            self.set(query, value)
+        return value
+
+    async def aget_or_fetch(self, query, fetch, refresh=False):
+        """Async version of get_or_fetch; ``fetch`` is a coroutine function."""
+        value = None if refresh else await sync_to_async(self.get)(query)
+        if value is not None:
+            return value
+
+        value = await fetch()
+        if value is not None:
+            await sync_to_async(self.set)(query, value)
+        return value
+
+    def _evict(self):
+        entries = LookupCacheEntry.objects.filter(namespace=self.namespace)
+        overflow = entries.count() - self.max_entries
+        if overflow <= 0:
+            return
+        # Evict a little extra so we don't run a DELETE on every insert at the limit
+        overflow += max(1, self.max_entries // 20)
+        self.flush_hits()  # so recently hit entries are not evicted as stale
+        stale = entries.order_by("last_used_at").values_list("pk", flat=True)[:overflow]
+        LookupCacheEntry.objects.filter(pk__in=list(stale)).delete()
+
+    def stats(self):
+        self.flush_hits()
+        totals = LookupCacheEntry.objects.filter(namespace=self.namespace).aggregate(
+            hits=Sum("hits"), misses=Sum("misses"))
+        hits, misses = totals["hits"] or 0, totals["misses"] or 0
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
+
+    def clear(self):
+        LookupCacheEntry.objects.filter(namespace=self.namespace).delete()
+
+
+# Trip details: serialized payloads are cached per trip version (its updated_at), so a
+# cached payload never goes stale. With a shared cache the versions are cached too and
+# polling an unchanged trip needs no queries; otherwise it costs one primary-key lookup.
+
+def trip_version(trip_id):
+    """Returns the trip's current version (its ``updated_at``), or None if there is no such trip."""
+    key = f"trip-version:{trip_id}"
+    version = _cache_call(cache.get, key) if settings.TRIP_VERSION_TTL else None
+    if version is None:
+        version = Trip.objects.filter(id=trip_id).values_list("updated_at", flat=True).first()
+        if version is not None and settings.TRIP_VERSION_TTL:
+            _cache_call(cache.set, key, version, settings.TRIP_VERSION_TTL)
+    return version
+
+
+def version_tag(version):
+    return f"{int(version.timestamp() * 1_000_000):x}"
+
+
+def get_trip_payload(trip_id, version, variant):
+    return _cache_call(cache.get, f"trip-detail:{trip_id}:{version_tag(version)}:{variant}")
+
+
+def set_trip_payload(trip_id, version, variant, payload):
+    _cache_call(cache.set, f"trip-detail:{trip_id}:{version_tag(version)}:{variant}", payload,
+                settings.TRIP_CACHE_TTL)
+
+
+def invalidate_trips(trip_ids):
+    """
+    Drops the cached versions of trips once the current transaction commits.
+
+    Payloads are keyed by version, so the next read picks up the new
+    ``updated_at`` and never sees the old payloads again.
+    """
+    keys = [f"trip-version:{trip_id}" for trip_id in trip_ids]
+    if keys:
+        transaction.on_commit(lambda: _cache_call(cache.delete_many, keys))
+
+
+def touch_trips(trip_ids):
+    """Bumps ``updated_at`` on trips whose logs changed and drops their cached versions."""
+    trip_ids = list(trip_ids)
+    Trip.objects.filter(id__in=trip_ids).update(updated_at=timezone.now())
+    invalidate_trips(trip_ids)
+
+
+def _cache_call(method, *args):
+    # A cache outage must never break trip details; treat it as a miss
+    try:
+        return method(*args)
+    except Exception as e:
+        logger.error(f"Trip cache unavailable: {e}")
+        return None
@@ -0,0 +1,243 @@
+"""
+Truck-to-load dispatch.
+
+match_loads pairs trucks with loads so the total deadhead (empty) miles are
+as low as possible:
+
+1. Straight-line deadhead for every truck/load pair in one vectorized
+   haversine; each load keeps its DISPATCH_CANDIDATES nearest trucks within
+   DISPATCH_MAX_DEADHEAD_MILES.
+2. Road miles and hours for that short list, and for each load's loaded leg,
+   from the Mapbox Matrix API. Results are cached per origin/destination
+   pair and missing pairs are packed into as few requests as possible,
+   fetched in parallel.
+3. A pair is kept only if schedule_duty_days can fit its deadhead plus
+   loaded driving into the truck's remaining cycle hours.
+4. A Hungarian assignment over the road deadhead miles of the kept pairs.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+import numpy as np
+import requests
+from django.conf import settings
+from .caching import LookupCache, normalize_coordinate
+from .geometry import haversine_miles
+from .hos import CYCLE_LIMIT_HOURS, schedule_duty_days
+from .metrics import submit_with_context, timed
+from .services import METERS_PER_MILE, mapbox
+
+logger = logging.getLogger("django")
+
+distance_cache = LookupCache("road_distance", settings.ROUTE_CACHE_TTL, settings.ROUTE_CACHE_MAX_ENTRIES)
+
+# Cost of a pair that must never be assigned; far above any real deadhead total
+FORBIDDEN = 1e12
+
+
+def match_loads(trucks, loads):
+    """
+    Assigns trucks to loads.
+
+    Args:
+        trucks (list): dicts with ``id``, ``location`` ("lon,lat") and
+            ``hours_available`` (hours left in the driver's cycle)
+        loads (list): dicts with ``id``, ``pickup_location`` and ``dropoff_location``
+
+    Returns:
+        dict: ``assignments`` (one per matched load, with the road deadhead
+        and driving involved), ``unassigned_loads`` (with a reason) and
+        ``unassigned_trucks``
+    """
+    truck_points = np.array([_point(truck["location"]) for truck in trucks]).reshape(-1, 2)
+    pickup_points = np.array([_point(load["pickup_location"]) for load in loads]).reshape(-1, 2)
+
+    with timed("prefilter"):
+        straight = haversine_miles(truck_points[:, 1, None], truck_points[:, 0, None],
+                                   pickup_points[None, :, 1], pickup_points[None, :, 0])
+        nearest = np.argsort(straight, axis=0, kind="stable")[:settings.DISPATCH_CANDIDATES]
+        candidates = [(int(t), n) for n in range(len(loads)) for t in nearest[:, n]
+                      if straight[t, n] <= settings.DISPATCH_MAX_DEADHEAD_MILES]
+
+    with timed("road_distances"):
+        pairs = {(trucks[t]["location"], loads[n]["pickup_location"]) for t, n in candidates}
+        pairs |= {(load["pickup_location"], load["dropoff_location"]) for load in loads}
+        road = road_distances(pairs)
+
+    today = date.today()
+    cost = np.full((len(trucks), len(loads)), FORBIDDEN)
+    details = {}
+    with timed("hos"):
+        for t, n in candidates:
+            deadhead = road.get((trucks[t]["location"], loads[n]["pickup_location"]))
+            loaded = road.get((loads[n]["pickup_location"], loads[n]["dropoff_location"]))
+            if deadhead is None or loaded is None:
+                continue
+            driving_hours = deadhead[1] + loaded[1]
+            duty_days = _duty_days(driving_hours, trucks[t]["hours_available"], today)
+            if duty_days is not None:
+                cost[t, n] = deadhead[0]
+                details[t, n] = {
+                    "deadhead_miles": round(deadhead[0], 2),
+                    "deadhead_hours": round(deadhead[1], 2),
+                    "loaded_miles": round(loaded[0], 2),
+                    "driving_hours": round(driving_hours, 2),
+                    "duty_days": duty_days,
+                }
+
+    with timed("assignment"):
+        matched = [(t, n) for t, n in assign(cost) if cost[t, n] < FORBIDDEN]
+
+    assigned_trucks, assigned_loads = {t for t, _ in matched}, {n for _, n in matched}
+    candidate_loads = {n for _, n in candidates}
+    feasible_loads = {n for _, n in details}
+    return {
+        "assignments": [
+            {"truck": trucks[t]["id"], "load": loads[n]["id"], **details[t, n]}
+            for t, n in sorted(matched, key=lambda pair: pair[1])
+        ],
+        "total_deadhead_miles": round(sum(cost[t, n] for t, n in matched), 2),
+        "unassigned_loads": [
+            {"load": load["id"], "reason": ("no truck nearby" if n not in candidate_loads else
+                                            "no truck with enough hours" if n not in feasible_loads else
+                                            "trucks taken by other loads")}
+            for n, load in enumerate(loads) if n not in assigned_loads
+        ],
+        "unassigned_trucks": [truck["id"] for t, truck in enumerate(trucks) if t not in assigned_trucks],
+    }
+
+
+def _duty_days(driving_hours, hours_available, start_date):
+    """Duty days needed to drive ``driving_hours`` within the cycle, or None if it does not fit."""
+    days = schedule_duty_days(driving_hours, CYCLE_LIMIT_HOURS - hours_available, start_date)
+    if sum(day.driving_hours for day in days) < driving_hours - 1e-6:
+        return None
+    return len(days)
+
+
+def assign(cost):
+    """
+    Minimum-cost assignment (Hungarian algorithm, shortest augmenting paths).
+
+    Works on any rows x cols matrix; every row of the smaller side is
+    assigned. Returns (row, col) pairs.
+    """
+    cost = np.asarray(cost, dtype=float)
+    if cost.size == 0:
+        return []
+    if cost.shape[0] > cost.shape[1]:
+        return [(row, col) for col, row in assign(cost.T)]
+
+    rows, cols = cost.shape
+    u, v = np.zeros(rows + 1), np.zeros(cols + 1)
+    owner = np.zeros(cols + 1, dtype=int)  # 1-based row assigned to each column, 0 if free
+    way = np.zeros(cols + 1, dtype=int)
+    for row in range(1, rows + 1):
+        owner[0] = row
+        col = 0
+        min_reduced = np.full(cols + 1, np.inf)
+        used = np.zeros(cols + 1, dtype=bool)
+        while owner[col]:
+            used[col] = True
+            current = owner[col]
+            free = ~used
+            free[0] = False
+            reduced = cost[current - 1] - u[current] - v[1:]
+            better = free[1:] & (reduced < min_reduced[1:])
+            min_reduced[1:][better] = reduced[better]
+            way[1:][better] = col
+            next_col = int(np.argmin(np.where(free, min_reduced, np.inf)))
+            delta = min_reduced[next_col]
+            u[owner[used]] += delta
+            v[used] -= delta
+            min_reduced[free] -= delta
+            col = next_col
+        while col:
+            previous = way[col]
+            owner[col] = owner[previous]
+            col = previous
+    return [(int(owner[col]) - 1, col - 1) for col in range(1, cols + 1) if owner[col]]
+
+
+def road_distances(pairs):
+    """
+    Road (miles, hours) for each (origin, destination) pair of "lon,lat" strings.
+
+    Pairs Mapbox cannot route, or whose request failed, are left out.
+    """
+    pairs = list(pairs)
+    keys = [_pair_key(origin, destination) for origin, destination in pairs]
+    cached = distance_cache.get_many(keys)
+    result = {pair: tuple(value) for pair, value in zip(pairs, cached) if value is not None}
+    missing = [pair for pair, value in zip(pairs, cached) if value is None]
+
+    batches = _matrix_batches(missing, settings.MATRIX_MAX_COORDINATES)
+    if len(batches) > 1:
+        with ThreadPoolExecutor(max_workers=min(settings.DIRECTIONS_WORKERS, len(batches)),
+                                thread_name_prefix="matrix") as executor:
+            futures = [submit_with_context(executor, _fetch_matrix, batch) for batch in batches]
+            fetched = [future.result() for future in futures]
+    else:
+        fetched = [_fetch_matrix(batch) for batch in batches]
+
+    fetched = {pair: value for distances in fetched for pair, value in distances.items()}
+    distance_cache.set_many((_pair_key(*pair), list(value)) for pair, value in fetched.items())
+    return {**result, **fetched}
+
+
+def _pair_key(origin, destination):
+    precision = settings.ROUTE_CACHE_PRECISION
+    return f"{normalize_coordinate(origin, precision)}|{normalize_coordinate(destination, precision)}"
+
+
+def _matrix_batches(pairs, max_coordinates):
+    """Packs pairs into requests of at most ``max_coordinates`` distinct points, grouped by destination."""
+    by_destination = {}
+    for origin, destination in pairs:
+        by_destination.setdefault(destination, []).append(origin)
+
+    batches, batch, points = [], [], set()
+    for destination, origins in by_destination.items():
+        for start in range(0, len(origins), max_coordinates - 1):
+            part = origins[start:start + max_coordinates - 1]
+            if batch and len(points | set(part) | {destination}) > max_coordinates:
+                batches.append(batch)
+                batch, points = [], set()
+            batch += [(origin, destination) for origin in part]
+            points |= set(part) | {destination}
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _fetch_matrix(pairs):
+    """One Matrix request covering ``pairs``; returns {pair: (miles, hours)} for the routable ones."""
+    origins = list(dict.fromkeys(origin for origin, _ in pairs))
+    destinations = list(dict.fromkeys(destination for _, destination in pairs))
+    points = list(dict.fromkeys(origins + destinations))
+    index = {point: i for i, point in enumerate(points)}
+    params = {
+        "sources": ";".join(str(index[point]) for point in origins),
+        "destinations": ";".join(str(index[point]) for point in destinations),
+        "annotations": "distance,duration",
+    }
+    try:
+        data = mapbox.get("matrix", f"/directions-matrix/v1/mapbox/driving/{';'.join(points)}", params)
+        distances, durations = data["distances"], data["durations"]
+    except (requests.RequestException, KeyError) as e:
+        logger.error(f"Mapbox Matrix API Error: {e}")
+        return {}
+
+    rows = {point: i for i, point in enumerate(origins)}
+    cols = {point: j for j, point in enumerate(destinations)}
+    result = {}
+    for origin, destination in pairs:
+        i, j = rows[origin], cols[destination]
+        if distances[i][j] is not None and durations[i][j] is not None:
+            result[origin, destination] = (distances[i][j] / METERS_PER_MILE, durations[i][j] / 3600)
+    return result
+
+
+def _point(location):
+    lon, lat = (float(part) for part in location.split(","))
+    return lon, lat
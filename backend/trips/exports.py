@@ -0,0 +1,89 @@
+"""
+Streaming CSV/NDJSON exports.
+
+Rows are read with ``values_list().iterator()`` (a server-side cursor on
+PostgreSQL) and written out a chunk at a time, so memory use does not grow
+with the size of the export and the first bytes go out before the query
+has finished. Served over ASGI, the chunks are handed to Django as an async
+iterator (achunks); otherwise Django would read the whole export into a list
+before sending the first byte.
+"""
+import csv
+import io
+import json
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+
+EXPORT_FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+CHUNK_SIZE = 2000
+
+TRIP_EXPORT_FIELDS = (
+    "id", "driver_id", "current_location", "pickup_location", "dropoff_location", "cycle_hours",
+    "sleeper_berth_hours", "cycle_start_date", "cycle_hours_remaining", "violations",
+    "created_at", "updated_at",
+)
+LOG_EXPORT_FIELDS = (
+    "id", "trip_id", "date", "driving_hours", "on_duty_hours", "off_duty_hours", "sleeper_berth_hours",
+)
+
+
+def stream_rows(queryset, fields, export_format):
+    """Yields the rows of ``queryset`` as CSV (with a header line) or NDJSON, one chunk at a time."""
+    rows = queryset.values_list(*fields).iterator(chunk_size=CHUNK_SIZE)
+    if export_format == "csv":
+        return _csv_chunks(rows, fields)
+    return _ndjson_chunks(rows, fields)
+
+
+async def achunks(chunks):
+    """Async iterator over a stream_rows generator, advancing it one chunk per sync_to_async call."""
+    # Thread-sensitive, so every chunk is read on the thread (and cursor) that started the query
+    next_chunk = sync_to_async(next)
+    try:
+        while (chunk := await next_chunk(chunks, None)) is not None:
+            yield chunk
+    finally:
+        # Closes the database cursor when the client disconnects mid-export
+        await sync_to_async(chunks.close)()
+
+
+def _csv_chunks(rows, fields):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    # Send the header straight away, before the first rows arrive
+    yield _drain(buffer)
+
+    for count, row in enumerate(rows, 1):
+        writer.writerow(json.dumps(value) if isinstance(value, (list, dict)) else value for value in row)
+        if count % CHUNK_SIZE == 0:
+            yield _drain(buffer)
+    yield _drain(buffer)
+
+
+def _ndjson_chunks(rows, fields):
+    encoder = DjangoJSONEncoder()
+    first = next(rows, None)
+    if first is None:
+        return
+    # Send the first row straight away, like the CSV header
+    yield encoder.encode(dict(zip(fields, first))) + "\n"
+
+    lines = []
+    for row in rows:
+        lines.append(encoder.encode(dict(zip(fields, row))))
+        if len(lines) == CHUNK_SIZE:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+def _drain(buffer):
+    data = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return data
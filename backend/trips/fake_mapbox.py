@@ -0,0 +1,212 @@
+"""
+Offline stand-in for the Mapbox APIs used by the planner.
+
+FakeMapbox answers directions, matrix, forward/reverse geocoding and category
+search requests with synthetic (or recorded) responses after a configurable
+delay. It plugs into MapboxClient as a requests transport adapter for get()
+and an httpx transport for aget(), so the whole planning pipeline runs
+without network access:
+
+    with FakeMapbox(latency=0.08).installed(mapbox):
+        ...
+"""
+import asyncio
+import hashlib
+import json
+import random
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import parse_qs, unquote, urlsplit
+import httpx
+import numpy as np
+import requests
+from requests.adapters import BaseAdapter
+from .geometry import haversine_miles
+
+METERS_PER_MILE = 1609.34
+POINTS_PER_MILE = 2  # density of synthetic route geometry, close to Mapbox's overview=full
+
+
+class FakeMapbox:
+    """
+    Serves Mapbox-shaped responses.
+
+    Args:
+        latency (float): seconds every request takes
+        jitter (float): extra random delay of up to this many seconds
+        error_rate (float): fraction of requests answered with a 503
+        speed_mph (float): average speed used for route durations
+        fixtures (dict): recorded response bodies by endpoint ("directions",
+            "matrix", "geocoding", "search"), served instead of synthetic ones
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, speed_mph=55.0, fixtures=None, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.speed_mph = speed_mph
+        self.fixtures = fixtures or {}
+        self.calls = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_fixture_file(cls, path, **kwargs):
+        with open(path, encoding="utf-8") as f:
+            return cls(fixtures=json.load(f), **kwargs)
+
+    def delay(self):
+        with self._lock:
+            return self.latency + self._random.uniform(0, self.jitter)
+
+    def respond(self, url):
+        """Returns (status code, JSON body) for a Mapbox request URL."""
+        parts = urlsplit(url)
+        path = unquote(parts.path)
+        params = {key: values[0] for key, values in parse_qs(parts.query).items()}
+        endpoint = ("directions" if path.startswith("/directions/") else
+                    "matrix" if path.startswith("/directions-matrix/") else
+                    "search" if path.startswith("/search/") else "geocoding")
+
+        with self._lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+            failed = self._random.random() < self.error_rate
+        if failed:
+            return 503, {"message": "Service Unavailable"}
+        if endpoint in self.fixtures:
+            return 200, self.fixtures[endpoint]
+
+        if endpoint == "directions":
+            waypoints = [_parse_coordinate(point) for point in path.rsplit("/", 1)[-1].split(";")]
+            return 200, self.directions(waypoints)
+        if endpoint == "matrix":
+            coordinates = [_parse_coordinate(point) for point in path.rsplit("/", 1)[-1].split(";")]
+            return 200, self.matrix(coordinates, _indexes(params.get("sources")), _indexes(params.get("destinations")))
+        if endpoint == "search":
+            return 200, self.category_search(path.rsplit("/", 1)[-1], _parse_coordinate(params["proximity"]))
+        query = path.rsplit("/", 1)[-1].removesuffix(".json")
+        try:
+            return 200, self.reverse_geocode(_parse_coordinate(query))
+        except ValueError:
+            return 200, self.geocode(query)
+
+    def directions(self, waypoints):
+        legs, coordinates = [], [list(waypoints[0])]
+        for start, end in zip(waypoints, waypoints[1:]):
+            miles = float(haversine_miles(start[1], start[0], end[1], end[0]))
+            steps = max(2, int(miles * POINTS_PER_MILE))
+            # A gentle S-curve so simplification and interpolation have real work to do
+            t = np.linspace(0, 1, steps + 1)[1:]
+            bend = np.sin(t * np.pi * 2) * 0.05
+            lons = start[0] + (end[0] - start[0]) * t + bend
+            lats = start[1] + (end[1] - start[1]) * t - bend
+            coordinates += np.column_stack((lons, lats)).tolist()
+
+            distance = miles * METERS_PER_MILE
+            duration = miles / self.speed_mph * 3600
+            legs.append({
+                "distance": distance,
+                "duration": duration,
+                "steps": [{"distance": distance / 2, "duration": duration / 2}] * 2,
+            })
+        return {
+            "code": "Ok",
+            "routes": [{
+                "distance": sum(leg["distance"] for leg in legs),
+                "duration": sum(leg["duration"] for leg in legs),
+                "geometry": {"type": "LineString", "coordinates": coordinates},
+                "legs": legs,
+            }],
+            "waypoints": [{"name": "", "location": list(point)} for point in waypoints],
+        }
+
+    def matrix(self, coordinates, sources=None, destinations=None):
+        sources = range(len(coordinates)) if sources is None else sources
+        destinations = range(len(coordinates)) if destinations is None else destinations
+        miles = [[float(haversine_miles(coordinates[i][1], coordinates[i][0], coordinates[j][1], coordinates[j][0]))
+                  for j in destinations] for i in sources]
+        return {
+            "code": "Ok",
+            "distances": [[m * METERS_PER_MILE for m in row] for row in miles],
+            "durations": [[m / self.speed_mph * 3600 for m in row] for row in miles],
+        }
+
+    def geocode(self, query):
+        # Stable pseudo-random point in the continental US for each query
+        digest = int(hashlib.sha1(query.lower().encode()).hexdigest()[:12], 16)
+        lon = -124 + (digest % 10_000) / 10_000 * 57
+        lat = 25 + (digest // 10_000 % 10_000) / 10_000 * 24
+        return {"features": [{"place_name": query, "center": [round(lon, 6), round(lat, 6)]}]}
+
+    def reverse_geocode(self, coordinate):
+        lon, lat = coordinate
+        return {"features": [{"place_name": f"Place near {lat:.3f}, {lon:.3f}", "center": [lon, lat]}]}
+
+    def category_search(self, category, proximity):
+        lon, lat = proximity
+        return {"features": [{
+            "properties": {"place_name": f"Fake {category} near {lat:.2f}, {lon:.2f}", "maki": category},
+            "geometry": {"type": "Point", "coordinates": [lon + 0.01, lat + 0.01]},
+        }]}
+
+    def adapter(self):
+        return FakeMapboxAdapter(self)
+
+    def async_transport(self):
+        async def handle(request):
+            await asyncio.sleep(self.delay())
+            status, body = self.respond(str(request.url))
+            return httpx.Response(status, json=body)
+        return httpx.MockTransport(handle)
+
+    @contextmanager
+    def installed(self, client):
+        """Routes every request of a MapboxClient (sync and async) to this fake while active."""
+        adapters = dict(client.session.adapters)
+        transport = client.async_transport
+        client.session.mount("https://", self.adapter())
+        client.session.mount("http://", self.adapter())
+        client.async_transport = self.async_transport()
+        client._async_clients.clear()
+        try:
+            yield self
+        finally:
+            client.session.adapters.clear()
+            client.session.adapters.update(adapters)
+            client.async_transport = transport
+            client._async_clients.clear()
+
+
+class FakeMapboxAdapter(BaseAdapter):
+    """requests transport adapter answering from a FakeMapbox."""
+
+    def __init__(self, fake):
+        super().__init__()
+        self.fake = fake
+
+    def send(self, request, **kwargs):
+        time.sleep(self.fake.delay())
+        status, body = self.fake.respond(request.url)
+
+        response = requests.Response()
+        response.status_code = status
+        response.url = request.url
+        response.request = request
+        response.headers["Content-Type"] = "application/json"
+        response._content = json.dumps(body).encode()
+        return response
+
+    def close(self):
+        pass
+
+
+def _parse_coordinate(value):
+    lon, lat = (float(part) for part in value.split(","))
+    return lon, lat
+
+
+def _indexes(value):
+    if value in (None, "all"):
+        return None
+    return [int(index) for index in value.split(";")]
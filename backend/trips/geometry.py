@@ -0,0 +1,162 @@
+import numpy as np
+
+EARTH_RADIUS_MILES = 3958.7613
+EARTH_RADIUS_METERS = 6371008.8
+METERS_PER_PIXEL_AT_ZOOM_0 = 156543.03392  # Web Mercator, at the equator
+
+
+def haversine_miles(lat1, lon1, lat2, lon2):
+    """Vectorized great-circle distance in miles between arrays of degrees."""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = (np.sin((lat2 - lat1) / 2) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+class RouteIndex:
+    """
+    Cumulative-distance index over a route's coordinates.
+
+    Built once per route, then answers any number of "where is the point at
+    fraction/mile X" questions with a binary search instead of re-walking the
+    geometry for every stop.
+    """
+
+    def __init__(self, coordinates):
+        self.coords = np.asarray(coordinates, dtype=float).reshape(-1, 2)  # (lon, lat)
+        if len(self.coords) < 1:
+            raise ValueError("Route has no coordinates")
+
+        lons, lats = self.coords[:, 0], self.coords[:, 1]
+        segments = haversine_miles(lats[:-1], lons[:-1], lats[1:], lons[1:])
+        self.cumulative_miles = np.concatenate(([0.0], np.cumsum(segments)))
+
+    @classmethod
+    def from_geometry(cls, route_geometry):
+        """Builds an index from a GeoJSON LineString geometry."""
+        if not route_geometry or route_geometry['type'] != 'LineString':
+            raise ValueError("Invalid route geometry")
+        return cls(route_geometry['coordinates'])
+
+    @property
+    def total_miles(self):
+        return float(self.cumulative_miles[-1])
+
+    def points_at_miles(self, miles):
+        """
+        Interpolate points at absolute distances along the route.
+
+        Args:
+            miles (iterable): distances from the route start, in miles
+
+        Returns:
+            list: (lon, lat) tuples, one per requested distance. Distances past
+            the end of the route resolve to the last point.
+        """
+        targets = np.asarray(miles, dtype=float).reshape(-1)
+        if len(self.coords) < 2:
+            lon, lat = self.coords[0]
+            return [(float(lon), float(lat))] * len(targets)
+
+        cumulative = self.cumulative_miles
+        end = np.clip(np.searchsorted(cumulative, targets, side='left'), 1, len(cumulative) - 1)
+        start = end - 1
+
+        segment = cumulative[end] - cumulative[start]
+        along = np.divide(targets - cumulative[start], segment,
+                          out=np.zeros_like(targets), where=segment > 0)
+        along = np.clip(along, 0.0, 1.0)[:, None]
+
+        points = self.coords[start] + along * (self.coords[end] - self.coords[start])
+        return [(float(lon), float(lat)) for lon, lat in points]
+
+    def points_at_fractions(self, fractions):
+        """Interpolate points at fractions (0.0-1.0) of the total route distance."""
+        return self.points_at_miles(np.asarray(fractions, dtype=float) * self.total_miles)
+
+    def point_at_fraction(self, fraction):
+        return self.points_at_fractions([fraction])[0]
+
+
+def simplify(coordinates, tolerance):
+    """
+    Douglas-Peucker simplification of a (lon, lat) line.
+
+    Args:
+        coordinates (list): (lon, lat) pairs
+        tolerance (float): maximum distance in meters a dropped point may lie
+            from the simplified line
+
+    Returns:
+        list: the kept [lon, lat] pairs; the first and last points are always kept
+    """
+    points = np.asarray(coordinates, dtype=float).reshape(-1, 2)
+    if len(points) < 3 or tolerance <= 0:
+        return points.tolist()
+
+    lons, lats = np.radians(points[:, 0]), np.radians(points[:, 1])
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+
+        # Local equirectangular projection around the segment, in meters
+        scale = np.cos((lats[start] + lats[end]) / 2)
+        xs = (lons[start:end + 1] - lons[start]) * scale * EARTH_RADIUS_METERS
+        ys = (lats[start:end + 1] - lats[start]) * EARTH_RADIUS_METERS
+        dx, dy = xs[-1], ys[-1]
+        length2 = dx * dx + dy * dy
+
+        px, py = xs[1:-1], ys[1:-1]
+        t = np.clip((px * dx + py * dy) / length2, 0.0, 1.0) if length2 > 0 else 0.0
+        distances = np.hypot(px - t * dx, py - t * dy)
+
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            split = start + 1 + farthest
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+
+    return points[keep].tolist()
+
+
+def tolerance_for_zoom(zoom):
+    """Simplification tolerance (meters) of about one screen pixel at a map zoom level."""
+    return METERS_PER_PIXEL_AT_ZOOM_0 / 2 ** zoom
+
+
+def encode_polyline(coordinates, precision=5):
+    """Encodes (lon, lat) pairs with the Google encoded polyline algorithm (lat, lon order)."""
+    points = np.asarray(coordinates, dtype=float).reshape(-1, 2)
+    values = np.round(points[:, ::-1] * 10 ** precision).astype(np.int64)
+    deltas = np.diff(values, axis=0, prepend=np.zeros((1, 2), dtype=np.int64))
+
+    chunks = []
+    for value in deltas.ravel().tolist():
+        value = ~(value << 1) if value < 0 else value << 1
+        while value >= 0x20:
+            chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+            value >>= 5
+        chunks.append(chr(value + 63))
+    return "".join(chunks)
+
+
+def decode_polyline(encoded, precision=5):
+    """Inverse of encode_polyline; returns [lon, lat] pairs."""
+    values = []
+    value = shift = 0
+    for char in encoded:
+        byte = ord(char) - 63
+        value |= (byte & 0x1f) << shift
+        shift += 5
+        if byte < 0x20:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            value = shift = 0
+
+    lat_lons = np.cumsum(np.array(values, dtype=np.int64).reshape(-1, 2), axis=0) / 10 ** precision
+    return lat_lons[:, ::-1].tolist()
@@ -0,0 +1,121 @@
+"""
+Hours-of-service duty-day scheduler.
+
+Pure functions only: no ORM, no clock, no I/O. The views turn the returned
+DutyDay records into DriverLog rows.
+"""
+import datetime
+from dataclasses import dataclass
+
+CYCLE_LIMIT_HOURS = 70  # 70 hours / 8 days
+MAX_CYCLE_DAYS = 8
+DAILY_DRIVING_LIMIT = 11
+DUTY_WINDOW_HOURS = 14
+LOADING_HOURS = 2  # inspections/loading per duty day
+SPLIT_SLEEPER_HOURS = 8
+SPLIT_OFF_DUTY_HOURS = 2
+RESTART_TRIGGER_HOURS = 20  # driving over the last two records that triggers a restart
+RESTART_DAYS = 2
+RESTART_OFF_DUTY_HOURS = 34
+
+
+@dataclass(slots=True, frozen=True)
+class DutyDay:
+    date: datetime.date
+    driving_hours: float
+    on_duty_hours: float
+    off_duty_hours: float
+    sleeper_berth_hours: float
+
+    @property
+    def is_restart(self):
+        return is_restart(self.sleeper_berth_hours)
+
+
+def is_restart(sleeper_berth_hours):
+    return sleeper_berth_hours >= RESTART_OFF_DUTY_HOURS
+
+
+def schedule_duty_days(driving_hours, cycle_hours_used, start_date):
+    """
+    Spread ``driving_hours`` over duty days within the 70-hour/8-day cycle.
+
+    Args:
+        driving_hours (float): total driving time of the trip
+        cycle_hours_used (float): hours already used in the current cycle
+        start_date (date): date of the first duty day
+
+    Returns:
+        list: DutyDay records in date order, including any 34-hour restarts
+    """
+    days = []
+    remaining_driving = driving_hours
+    cycle_remaining = CYCLE_LIMIT_HOURS - cycle_hours_used
+    prev_day_ended_early = False
+
+    day = 0
+    while remaining_driving > 0 and day < MAX_CYCLE_DAYS:
+        # Calculate driving hours for the day
+        driving = min(DAILY_DRIVING_LIMIT, remaining_driving, cycle_remaining)
+        on_duty = min(DUTY_WINDOW_HOURS, driving + LOADING_HOURS)
+
+        # Determine sleeper berth/off-duty split
+        if day == 0:
+            # First day doesn't need sleeper berth
+            sleeper_berth = 0
+            off_duty = 24 - on_duty
+        elif driving > 8 or prev_day_ended_early:
+            # Use split sleeper berth if driving > 8 hours or previous day ended early
+            sleeper_berth = SPLIT_SLEEPER_HOURS
+            off_duty = SPLIT_OFF_DUTY_HOURS
+            prev_day_ended_early = False
+        else:
+            sleeper_berth = 0
+            off_duty = 24 - on_duty
+            # If we finish early, mark for split next day
+            if driving < 8 and remaining_driving - driving > 0:
+                prev_day_ended_early = True
+
+        days.append(DutyDay(start_date + datetime.timedelta(days=day), driving, on_duty, off_duty, sleeper_berth))
+
+        remaining_driving -= driving
+        cycle_remaining -= driving
+        day += 1
+
+        # Check for 34-hour restart opportunity
+        if day >= 2 and sum(d.driving_hours for d in days[-2:]) >= RESTART_TRIGGER_HOURS:
+            days.append(DutyDay(start_date + datetime.timedelta(days=day), 0, 0, 10, RESTART_OFF_DUTY_HOURS))
+            day += RESTART_DAYS  # Skip next 2 days for restart
+            cycle_remaining = CYCLE_LIMIT_HOURS  # Reset cycle
+
+    return days
+
+
+def cycle_hours_used(duty_hours, restart_dates, on_date):
+    """
+    On-duty hours that count toward the 70-hour/8-day cycle on ``on_date``.
+
+    Args:
+        duty_hours (dict): on-duty hours per ISO date string
+        restart_dates (list): ISO dates of 34-hour restarts; the latest one on
+            or before ``on_date`` and the days before it no longer count
+        on_date (date): last day of the 8-day window
+
+    Returns:
+        float: the window total; reads at most MAX_CYCLE_DAYS entries
+    """
+    start = on_date - datetime.timedelta(days=MAX_CYCLE_DAYS - 1)
+    restart = max((day for day in restart_dates if start.isoformat() <= day <= on_date.isoformat()), default=None)
+    if restart is not None:
+        start = datetime.date.fromisoformat(restart) + datetime.timedelta(days=1)
+    return sum(duty_hours.get((start + datetime.timedelta(days=i)).isoformat(), 0)
+               for i in range((on_date - start).days + 1))
+
+
+def earliest_restart_end(last_duty_date):
+    """When a 34-hour restart begun right after the last duty day would end (day granularity, UTC)."""
+    if last_duty_date is None:
+        return None
+    off_duty_from = datetime.datetime.combine(last_duty_date + datetime.timedelta(days=1), datetime.time.min,
+                                              tzinfo=datetime.timezone.utc)
+    return off_duty_from + datetime.timedelta(hours=RESTART_OFF_DUTY_HOURS)
@@ -0,0 +1,68 @@
+"""
+Background trip planning on an in-process thread pool.
+
+No broker: jobs live in the PlanningJob table and run on a bounded pool in the
+web process that accepted them. A job that was queued or running when its
+process stopped stays in that state; clients see it never progress and can
+re-submit the trip.
+"""
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+from rest_framework.utils.encoders import JSONEncoder
+from .models import PlanningJob, Trip
+from .planning import plan_trip
+
+logger = logging.getLogger("django")
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.PLANNING_WORKERS,
+                                           thread_name_prefix="trip-planner")
+        return _executor
+
+
+def enqueue_planning(trip, geometry_options, refresh=False):
+    """Creates a queued PlanningJob for a saved trip and schedules it once the trip is committed."""
+    job = PlanningJob.objects.create(trip=trip)
+    transaction.on_commit(
+        lambda: _get_executor().submit(run_planning_job, job.id, geometry_options, refresh))
+    return job
+
+
+def run_planning_job(job_id, geometry_options, refresh=False):
+    """Runs one planning job on a worker thread, recording progress and the outcome on its row."""
+    close_old_connections()
+    try:
+        jobs = PlanningJob.objects.filter(id=job_id)
+        jobs.update(status="running", updated_at=timezone.now())
+
+        def progress(stage, percent):
+            jobs.update(stage=stage, progress=percent, updated_at=timezone.now())
+
+        try:
+            trip = Trip.objects.get(id=jobs.values_list("trip_id", flat=True).get())
+            payload = plan_trip(trip, geometry_options, refresh=refresh, progress=progress)
+        except Exception as e:
+            logger.exception(f"Planning job {job_id} failed")
+            now = timezone.now()
+            jobs.update(status="failed", error=str(e), updated_at=now, finished_at=now)
+            return
+
+        # Store exactly what the synchronous endpoint would have returned
+        result = json.loads(json.dumps(payload, cls=JSONEncoder))
+        now = timezone.now()
+        jobs.update(status="succeeded", stage="done", progress=100, result=result,
+                    updated_at=now, finished_at=now)
+    finally:
+        connection.close()
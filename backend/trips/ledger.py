@@ -0,0 +1,135 @@
+"""
+Drivers' rolling 70-hour/8-day cycle ledger.
+
+Each Driver row carries its on-duty hours per day from the start of the
+current 8-day window (days already planned ahead included), the restarts in
+that range and the rolling total as of ``cycle_date``. Planning a trip adds
+its duty days in the transaction that writes the logs, so finding out how
+many hours a driver has left never scans DriverLog: it is the stored total,
+or at most eight dictionary reads once the day has rolled over.
+
+A driver's next trip is scheduled from start_date: the day after their last
+planned day, so planned days never overlap, with the hours used in the
+window ending that day.
+"""
+import math
+from datetime import date, timedelta
+from django.db import transaction
+from django.db.models import Max
+from .hos import (
+    CYCLE_LIMIT_HOURS, MAX_CYCLE_DAYS, RESTART_DAYS, cycle_hours_used, earliest_restart_end, is_restart,
+)
+from .models import Driver, DriverLog
+
+LEDGER_FIELDS = ["duty_hours", "restart_dates", "cycle_hours", "cycle_date", "last_duty_date", "updated_at"]
+
+
+def hours_used(driver, on_date=None):
+    """On-duty hours the driver has used in the 8-day window ending ``on_date`` (default today)."""
+    on_date = on_date or date.today()
+    if driver.cycle_date == on_date:
+        return driver.cycle_hours
+    return cycle_hours_used(driver.duty_hours, driver.restart_dates, on_date)
+
+
+def cycle_hours(driver, on_date=None):
+    """hours_used as the whole hours a trip's ``cycle_hours`` stores, rounded up."""
+    return math.ceil(round(hours_used(driver, on_date), 6))
+
+
+def start_date(driver, today=None):
+    """First day the driver has nothing planned on: today, or the day after their last planned day."""
+    today = today or date.today()
+    last = max(map(date.fromisoformat, [*driver.duty_hours, *driver.restart_dates]), default=None)
+    if last is None or last < today:
+        return today
+    if last.isoformat() in driver.restart_dates:
+        # A restart's 34 hours run into the next day, as in schedule_duty_days
+        return last + timedelta(days=RESTART_DAYS)
+    return last + timedelta(days=1)
+
+
+def availability(driver, on_date=None):
+    """Hours left for the driver's next trip, which can start on ``available_from``."""
+    on_date = on_date or date.today()
+    available_from = start_date(driver, on_date)
+    used = hours_used(driver, available_from)
+    return {
+        "date": on_date,
+        "available_from": available_from,
+        "cycle_hours_used": round(used, 2),
+        "hours_available": round(max(0.0, CYCLE_LIMIT_HOURS - used), 2),
+        "earliest_restart": earliest_restart_end(driver.last_duty_date),
+    }
+
+
+def lock_drivers(driver_ids):
+    """
+    Locks the drivers' rows for the rest of the transaction; returns {id: Driver}.
+
+    Plan with the hours read here, not those validated with the request:
+    another plan for the same driver may have been saved since.
+    """
+    if not driver_ids:
+        return {}
+    # A fixed lock order keeps two batches for the same drivers from deadlocking
+    drivers = Driver.objects.select_for_update().filter(id__in=driver_ids).order_by("id")
+    return {driver.id: driver for driver in drivers}
+
+
+def apply_cycle_hours(trip, driver, today=None):
+    """Sets the trip's cycle hours from the driver's ledger; returns the date its schedule starts."""
+    first_day = start_date(driver, today)
+    trip.cycle_hours = cycle_hours(driver, first_day)
+    trip.cycle_hours_remaining = max(0, CYCLE_LIMIT_HOURS - trip.cycle_hours)
+    return first_day
+
+
+def add_duty(driver, logs, today=None):
+    """Adds logs to a locked driver's ledger in memory, so the driver's next plan sees them."""
+    _apply(driver, [(log.date, log.on_duty_hours, log.sleeper_berth_hours) for log in logs], today or date.today())
+
+
+def record_duty(driver, logs, today=None):
+    """
+    Adds newly written logs to their driver's ledger and saves it.
+
+    ``driver`` comes from lock_drivers, in the transaction that writes the
+    logs, so concurrent plans for one driver add up correctly.
+    """
+    add_duty(driver, logs, today)
+    driver.save(update_fields=LEDGER_FIELDS)
+    return driver
+
+
+def rebuild(driver_id, today=None):
+    """Recomputes a driver's ledger from their logs, e.g. after logs were edited or deleted."""
+    today = today or date.today()
+    logs = DriverLog.objects.filter(trip__driver_id=driver_id)
+    with transaction.atomic():
+        driver = Driver.objects.select_for_update().get(id=driver_id)
+        driver.duty_hours, driver.restart_dates = {}, []
+        driver.last_duty_date = logs.filter(on_duty_hours__gt=0).aggregate(last=Max("date"))["last"]
+        window = logs.filter(date__gte=today - timedelta(days=MAX_CYCLE_DAYS - 1))
+        _apply(driver, window.values_list("date", "on_duty_hours", "sleeper_berth_hours"), today)
+        driver.save(update_fields=LEDGER_FIELDS)
+    return driver
+
+
+def _apply(driver, days, today):
+    duty_hours = dict(driver.duty_hours)
+    restart_dates = set(driver.restart_dates)
+    for day, on_duty_hours, sleeper_berth_hours in days:
+        key = day.isoformat()
+        duty_hours[key] = duty_hours.get(key, 0) + on_duty_hours
+        if is_restart(sleeper_berth_hours):
+            restart_dates.add(key)
+        if on_duty_hours > 0 and (driver.last_duty_date is None or day > driver.last_duty_date):
+            driver.last_duty_date = day
+
+    # Days before the window can never count again; ISO dates compare as strings
+    window_start = (today - timedelta(days=MAX_CYCLE_DAYS - 1)).isoformat()
+    driver.duty_hours = {key: hours for key, hours in duty_hours.items() if key >= window_start}
+    driver.restart_dates = sorted(key for key in restart_dates if key >= window_start)
+    driver.cycle_date = today
+    driver.cycle_hours = cycle_hours_used(driver.duty_hours, driver.restart_dates, today)
@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Prefetch
+from django.utils import timezone
+from trips.caching import invalidate_trips
+from trips.models import DriverLog, Trip
+from trips.services import compliance_violations
+
+
+class Command(BaseCommand):
+    help = "Re-checks HOS compliance for all trips and stores the result in Trip.violations."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500,
+                            help="Trips loaded (with their logs) per batch of queries.")
+        parser.add_argument("--dry-run", action="store_true",
+                            help="Report changes without saving them.")
+
+    def handle(self, *args, batch_size, dry_run, **options):
+        logs = Prefetch("logs", queryset=DriverLog.objects.order_by("date", "id"))
+        checked = changed = flagged = 0
+        last_id = 0
+
+        while True:
+            # Two queries per batch (trips + their logs) instead of one per trip
+            batch = list(Trip.objects.filter(id__gt=last_id).order_by("id")
+                         .prefetch_related(logs)[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            updates = []
+            for trip in batch:
+                violations = compliance_violations(trip.logs.all())
+                flagged += bool(violations)
+                if violations != trip.violations:
+                    trip.violations = violations
+                    trip.updated_at = timezone.now()
+                    updates.append(trip)
+
+            checked += len(batch)
+            changed += len(updates)
+            if updates and not dry_run:
+                with transaction.atomic():
+                    Trip.objects.bulk_update(updates, ["violations", "updated_at"], batch_size=batch_size)
+                    invalidate_trips([trip.id for trip in updates])
+
+        verb = "would change" if dry_run else "updated"
+        self.stdout.write(self.style.SUCCESS(
+            f"Checked {checked} trips: {flagged} with violations, {verb} {changed}."))
@@ -0,0 +1,165 @@
+import json
+import logging
+import random
+import time
+from datetime import date
+from pathlib import Path
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import Client
+from trips.fake_mapbox import FakeMapbox
+from trips.hos import schedule_duty_days
+from trips.services import (
+    _parse_route, calculate_interval_point, calculate_stops, calculate_trip_details, mapbox, route_cache,
+)
+
+BENCHMARKS = ("interval_point", "calculate_stops", "hos_schedule", "create_trip", "get_all_trips")
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ("Benchmarks the planner against an offline fake Mapbox and reports throughput and "
+            "p50/p95/p99 latency. Nothing leaves the machine and all rows written are rolled back.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=50, help="Timed runs per benchmark.")
+        parser.add_argument("--warmup", type=int, default=3, help="Untimed runs before each benchmark.")
+        parser.add_argument("--only", nargs="+", choices=BENCHMARKS, help="Benchmarks to run (default: all).")
+        parser.add_argument("--latency", type=float, default=50.0, help="Fake Mapbox latency per request (ms).")
+        parser.add_argument("--jitter", type=float, default=0.0, help="Extra random latency of up to this many ms.")
+        parser.add_argument("--error-rate", type=float, default=0.0,
+                            help="Fraction of fake Mapbox requests that return 503.")
+        parser.add_argument("--fixtures", help="JSON file of recorded Mapbox responses by endpoint.")
+        parser.add_argument("--warm-cache", action="store_true",
+                            help="Plan the same lane every time so create_trip hits the route cache.")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--save", help="Write the results to this JSON file (e.g. a new baseline).")
+        parser.add_argument("--compare", help="Baseline JSON file from --save to check against.")
+        parser.add_argument("--max-regression", type=float, default=0.25,
+                            help="Fail when a p95 is this much slower than the baseline (0.25 = 25%%).")
+
+    def handle(self, *args, **options):
+        fake_options = {"latency": options["latency"] / 1000, "jitter": options["jitter"] / 1000,
+                        "error_rate": options["error_rate"], "seed": options["seed"]}
+        fake = (FakeMapbox.from_fixture_file(options["fixtures"], **fake_options) if options["fixtures"]
+                else FakeMapbox(**fake_options))
+        self.random = random.Random(options["seed"])
+        self.warm_cache = options["warm_cache"]
+
+        # The planner logs every stop and POI at INFO; keep the report readable
+        django_logger = logging.getLogger("django")
+        log_level = django_logger.level
+        if options["verbosity"] < 2:
+            django_logger.setLevel(logging.WARNING)
+
+        results = {}
+        with fake.installed(mapbox):
+            try:
+                with transaction.atomic():
+                    for name in options["only"] or BENCHMARKS:
+                        setup = getattr(self, f"setup_{name}", None)
+                        run = setup() if setup else getattr(self, f"bench_{name}")
+                        for _ in range(options["warmup"]):
+                            run()
+                        results[name] = self.measure(run, options["iterations"])
+                        self.report(name, results[name])
+                    raise Rollback
+            except Rollback:
+                pass
+            finally:
+                django_logger.setLevel(log_level)
+
+        self.stdout.write(f"Fake Mapbox requests: {fake.calls}")
+        if options["save"]:
+            Path(options["save"]).write_text(json.dumps(results, indent=2))
+            self.stdout.write(f"Saved results to {options['save']}")
+        if options["compare"]:
+            self.compare(results, json.loads(Path(options["compare"]).read_text()), options["max_regression"])
+
+    def measure(self, run, iterations):
+        timings = []
+        started = time.perf_counter()
+        for _ in range(iterations):
+            start = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - start)
+        elapsed = time.perf_counter() - started
+
+        p50, p95, p99 = np.percentile(timings, [50, 95, 99]) * 1000
+        return {
+            "iterations": iterations,
+            "ops_per_sec": round(iterations / elapsed, 2),
+            "mean_ms": round(float(np.mean(timings)) * 1000, 3),
+            "p50_ms": round(float(p50), 3),
+            "p95_ms": round(float(p95), 3),
+            "p99_ms": round(float(p99), 3),
+        }
+
+    def report(self, name, result):
+        self.stdout.write(
+            f"{name:<16} {result['ops_per_sec']:>10.1f} ops/s  p50 {result['p50_ms']:>9.2f} ms  "
+            f"p95 {result['p95_ms']:>9.2f} ms  p99 {result['p99_ms']:>9.2f} ms"
+        )
+
+    def compare(self, results, baseline, max_regression):
+        regressions = []
+        for name, result in results.items():
+            if name not in baseline:
+                continue
+            before, after = baseline[name]["p95_ms"], result["p95_ms"]
+            if before > 0 and after > before * (1 + max_regression):
+                regressions.append(f"{name}: p95 {before:.2f} ms -> {after:.2f} ms")
+        if regressions:
+            raise CommandError("Performance regressions:\n" + "\n".join(regressions))
+        self.stdout.write(self.style.SUCCESS("No regressions against the baseline."))
+
+    def random_lane(self):
+        if self.warm_cache:
+            return "-97.7431,30.2672", "-96.797,32.7767", "-87.6298,41.8781"
+        return tuple(f"{self.random.uniform(-122, -72):.4f},{self.random.uniform(27, 47):.4f}" for _ in range(3))
+
+    def planned_route(self):
+        # A long (2,000+ mile) synthetic route, as Mapbox would return it
+        waypoints = [(-118.2437, 34.0522), (-104.9903, 39.7392), (-74.006, 40.7128)]
+        return FakeMapbox().directions(waypoints)
+
+    def setup_interval_point(self):
+        geometry = self.planned_route()["routes"][0]["geometry"]
+        return lambda: calculate_interval_point(geometry, self.random.random())
+
+    def setup_calculate_stops(self):
+        route_data = _parse_route(self.planned_route())
+        _, total_hours, total_miles = calculate_trip_details(route_data, 0)
+        route = route_data["routes"][0]
+        return lambda: calculate_stops(total_miles, total_hours, route["geometry"], route["legs"])
+
+    def bench_hos_schedule(self):
+        schedule_duty_days(self.random.uniform(1, 120), self.random.randint(0, 70), start_date=date.today())
+
+    def setup_create_trip(self):
+        client = Client()
+        if not self.warm_cache:
+            route_cache.clear()
+
+        def run():
+            start, pickup, dropoff = self.random_lane()
+            response = client.post("/api/trip/", data={
+                "current_location": start, "pickup_location": pickup, "dropoff_location": dropoff,
+                "cycle_hours": self.random.randint(0, 60),
+            }, content_type="application/json")
+            if response.status_code != 201:
+                raise CommandError(f"create_trip returned {response.status_code}: {response.content[:200]}")
+        return run
+
+    def setup_get_all_trips(self):
+        client = Client()
+
+        def run():
+            response = client.get("/api/trips/", {"page_size": 50, "include_logs": "true"})
+            if response.status_code != 200:
+                raise CommandError(f"get_all_trips returned {response.status_code}")
+        return run
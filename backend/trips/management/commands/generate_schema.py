@@ -0,0 +1,24 @@
+import os
+from pathlib import Path
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = ("Generates the OpenAPI schema served at /api/schema.json and by the Swagger/ReDoc pages. "
+            "Run it at build time, after code changes to the API.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--output", default=settings.OPENAPI_SCHEMA_PATH,
+                            help="Where to write the schema (default: OPENAPI_SCHEMA_PATH).")
+
+    def handle(self, *args, output, **options):
+        from mysite.docs import generate_schema
+
+        output = Path(output)
+        content = generate_schema()
+        # Write then rename, so a worker never reads a half-written schema
+        partial = output.with_name(output.name + ".tmp")
+        partial.write_bytes(content)
+        os.replace(partial, output)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {len(content)} bytes to {output}"))
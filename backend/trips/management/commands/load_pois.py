@@ -0,0 +1,76 @@
+import csv
+import json
+from pathlib import Path
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from trips.models import PointOfInterest
+
+CATEGORIES = {choice for choice, _ in PointOfInterest.CATEGORY_CHOICES}
+LATITUDE_COLUMNS = ("latitude", "lat")
+LONGITUDE_COLUMNS = ("longitude", "lon", "lng")
+
+
+class Command(BaseCommand):
+    help = ("Loads fuel stations, truck stops and hotels from a CSV or GeoJSON file into the "
+            "offline POI table used by calculate_stops before it falls back to Mapbox.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="CSV (name, category, latitude, longitude) or GeoJSON Points file.")
+        parser.add_argument("--category", choices=sorted(CATEGORIES),
+                            help="Category for rows that do not set their own.")
+        parser.add_argument("--source", default="", help="Dataset name stored with each POI.")
+        parser.add_argument("--replace", action="store_true",
+                            help="Delete POIs from the same --source before loading.")
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, path, category, source, replace, batch_size, **options):
+        path = Path(path)
+        if not path.exists():
+            raise CommandError(f"{path} does not exist")
+
+        reader = self.read_geojson if path.suffix.lower() in (".geojson", ".json") else self.read_csv
+        pois, skipped = [], 0
+        for name, poi_category, latitude, longitude in reader(path):
+            poi_category = (poi_category or category or "").strip().lower()
+            if poi_category not in CATEGORIES or latitude is None or longitude is None:
+                skipped += 1
+                continue
+            pois.append(PointOfInterest(name=(name or "Unknown")[:255], category=poi_category,
+                                        latitude=latitude, longitude=longitude, source=source))
+
+        with transaction.atomic():
+            if replace:
+                deleted, _ = PointOfInterest.objects.filter(source=source).delete()
+                self.stdout.write(f"Deleted {deleted} POIs from source '{source}'.")
+            PointOfInterest.objects.bulk_create(pois, batch_size=batch_size)
+
+        self.stdout.write(self.style.SUCCESS(f"Loaded {len(pois)} POIs ({skipped} skipped)."))
+
+    @staticmethod
+    def _float(value):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+
+    def read_csv(self, path):
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            for row in csv.DictReader(f):
+                row = {key.strip().lower(): value for key, value in row.items() if key}
+                latitude = next((row[c] for c in LATITUDE_COLUMNS if row.get(c)), None)
+                longitude = next((row[c] for c in LONGITUDE_COLUMNS if row.get(c)), None)
+                yield row.get("name"), row.get("category"), self._float(latitude), self._float(longitude)
+
+    def read_geojson(self, path):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        features = data.get("features", []) if isinstance(data, dict) else []
+        for feature in features:
+            geometry = feature.get("geometry") or {}
+            properties = feature.get("properties") or {}
+            if geometry.get("type") != "Point" or len(geometry.get("coordinates") or []) < 2:
+                yield None, None, None, None
+                continue
+            longitude, latitude = geometry["coordinates"][:2]
+            yield (properties.get("name"), properties.get("category"),
+                   self._float(latitude), self._float(longitude))
@@ -0,0 +1,342 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+import weakref
+from collections import deque
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from . import metrics
+
+logger = logging.getLogger("django")
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(requests.RequestException):
+    """Raised instead of calling Mapbox while an endpoint's circuit is open."""
+
+
+class InvalidResponseError(requests.RequestException):
+    """Mapbox answered with a body that is not JSON."""
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    After ``threshold`` failures in a row the circuit opens and calls fail fast
+    for ``cooldown`` seconds. Then a single trial call is let through
+    (half-open): success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.cooldown:
+            return "open"
+        return "half-open"
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_in_flight or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def release(self):
+        """Frees the trial slot of a call that ended without a result (e.g. cancelled)."""
+        with self._lock:
+            self._trial_in_flight = False
+
+
+class LatencyStats:
+    """Running latency totals plus a window of recent samples for percentiles."""
+
+    def __init__(self, window=1000):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds, error=False):
+        with self._lock:
+            self.count += 1
+            self.errors += int(error)
+            self.total += seconds
+            self.max = max(self.max, seconds)
+            self.samples.append(seconds)
+
+    def snapshot(self):
+        with self._lock:
+            samples = sorted(self.samples)
+            count, errors, total, longest = self.count, self.errors, self.total, self.max
+
+        def percentile(p):
+            if not samples:
+                return 0.0
+            return samples[min(len(samples) - 1, int(p / 100 * len(samples)))]
+
+        return {
+            "count": count,
+            "errors": errors,
+            "mean_ms": total / count * 1000 if count else 0.0,
+            "p50_ms": percentile(50) * 1000,
+            "p95_ms": percentile(95) * 1000,
+            "max_ms": longest * 1000,
+        }
+
+
+class MapboxClient:
+    """
+    Shared HTTP client for every Mapbox API call.
+
+    One pooled keep-alive session, a timeout per endpoint, jittered retries on
+    429/5xx and connection errors, a circuit breaker per endpoint and latency
+    stats per endpoint. Endpoints are short names ("directions", "geocoding",
+    "search") used for timeouts, breakers and stats.
+
+    get() is blocking; aget() is the asyncio twin backed by httpx, one pooled
+    AsyncClient per event loop. Both share breakers and stats, and both raise
+    requests exceptions so callers handle errors the same way.
+    """
+
+    BASE_URL = "https://api.mapbox.com"
+
+    def __init__(self, access_token, timeouts, connect_timeout=3.05, pool_size=20,
+                 max_retries=2, retry_backoff=0.25, retry_cap=5.0, breaker_threshold=5,
+                 breaker_cooldown=30):
+        self.access_token = access_token
+        self.timeouts = timeouts
+        self.connect_timeout = connect_timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.retry_cap = retry_cap
+        self.pool_size = pool_size
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(timeouts) or 1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._breakers = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._async_clients = weakref.WeakKeyDictionary()
+        self.async_transport = None
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            access_token=settings.MAPBOX_API_KEY,
+            timeouts=settings.MAPBOX_TIMEOUTS,
+            connect_timeout=settings.MAPBOX_CONNECT_TIMEOUT,
+            pool_size=settings.MAPBOX_POOL_SIZE,
+            max_retries=settings.MAPBOX_MAX_RETRIES,
+            retry_backoff=settings.MAPBOX_RETRY_BACKOFF,
+            breaker_threshold=settings.MAPBOX_BREAKER_THRESHOLD,
+            breaker_cooldown=settings.MAPBOX_BREAKER_COOLDOWN,
+        )
+
+    def breaker(self, endpoint):
+        with self._lock:
+            if endpoint not in self._breakers:
+                self._breakers[endpoint] = CircuitBreaker(self.breaker_threshold, self.breaker_cooldown)
+            return self._breakers[endpoint]
+
+    def stats(self, endpoint):
+        with self._lock:
+            if endpoint not in self._stats:
+                self._stats[endpoint] = LatencyStats()
+            return self._stats[endpoint]
+
+    def latency_stats(self):
+        """Per-endpoint latency summary plus the current circuit state."""
+        with self._lock:
+            endpoints = sorted(set(self._stats) | set(self._breakers))
+        return {
+            endpoint: {**self.stats(endpoint).snapshot(), "circuit": self.breaker(endpoint).state}
+            for endpoint in endpoints
+        }
+
+    def _record(self, endpoint, started, error=False):
+        elapsed = time.perf_counter() - started
+        self.stats(endpoint).record(elapsed, error=error)
+        metrics.observe_mapbox(endpoint, elapsed, error=error)
+
+    def backoff(self, attempt, response=None):
+        """Full-jitter exponential backoff, honouring Retry-After when Mapbox sends one."""
+        delay = random.uniform(0, self.retry_backoff * 2 ** attempt)
+        if response is not None:
+            try:
+                delay = max(delay, float(response.headers.get("Retry-After", 0)))
+            except ValueError:
+                pass
+        return min(delay, self.retry_cap)
+
+    def call_budget(self, endpoint, timeout=None):
+        """Longest a get()/aget() call can take: every attempt timing out, plus the longest backoffs."""
+        attempt = self.connect_timeout + (timeout or self.timeouts.get(endpoint, 10))
+        return attempt * (self.max_retries + 1) + self.retry_cap * self.max_retries
+
+    def get(self, endpoint, path, params=None, timeout=None):
+        """
+        GET ``path`` on the Mapbox API and return the decoded JSON body.
+
+        Raises:
+            CircuitOpenError: the endpoint's circuit is open
+            requests.RequestException: the call failed after all retries
+        """
+        breaker = self.breaker(endpoint)
+        if not breaker.allow():
+            raise CircuitOpenError(f"Mapbox {endpoint} circuit is open")
+
+        params = {**(params or {}), "access_token": self.access_token}
+        timeout = (self.connect_timeout, timeout or self.timeouts.get(endpoint, 10))
+
+        try:
+            for attempt in range(self.max_retries + 1):
+                retries_left = attempt < self.max_retries
+                started = time.perf_counter()
+                try:
+                    response = self.session.get(f"{self.BASE_URL}{path}", params=params, timeout=timeout)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    self._record(endpoint, started, error=True)
+                    if retries_left:
+                        logger.warning(f"Mapbox {endpoint} request failed ({e}), retrying")
+                        time.sleep(self.backoff(attempt))
+                        continue
+                    breaker.record_failure()
+                    raise
+                except requests.RequestException:
+                    self._record(endpoint, started, error=True)
+                    breaker.record_failure()
+                    raise
+
+                failed = response.status_code in RETRY_STATUSES
+                self._record(endpoint, started, error=failed)
+                if failed and retries_left:
+                    logger.warning(f"Mapbox {endpoint} returned {response.status_code}, retrying")
+                    time.sleep(self.backoff(attempt, response))
+                    continue
+
+                if failed:
+                    breaker.record_failure()
+                    response.raise_for_status()
+                if response.status_code >= 400:
+                    # Client errors (4xx other than 429) say nothing about Mapbox's health
+                    breaker.record_success()
+                    response.raise_for_status()
+                return self._decode(endpoint, breaker, response)
+        except requests.RequestException:
+            raise
+        except BaseException:
+            # Cancelled, or failed before an outcome was recorded: free the trial
+            # slot, or the circuit would stay half-open with no trial ever allowed
+            breaker.release()
+            raise
+
+    def _decode(self, endpoint, breaker, response):
+        """The JSON body of a successful response; a body that is not JSON counts as a failure."""
+        try:
+            data = response.json()
+        except ValueError as e:
+            breaker.record_failure()
+            raise InvalidResponseError(f"Invalid JSON from Mapbox {endpoint}: {e}") from e
+        breaker.record_success()
+        return data
+
+    def _async_client(self):
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = httpx.AsyncClient(
+                base_url=self.BASE_URL,
+                limits=httpx.Limits(max_connections=self.pool_size,
+                                    max_keepalive_connections=self.pool_size),
+                transport=self.async_transport,
+            )
+            self._async_clients[loop] = client
+        return client
+
+    async def aget(self, endpoint, path, params=None, timeout=None):
+        """Async version of get()."""
+        breaker = self.breaker(endpoint)
+        if not breaker.allow():
+            raise CircuitOpenError(f"Mapbox {endpoint} circuit is open")
+
+        client = self._async_client()
+        params = {**(params or {}), "access_token": self.access_token}
+        timeout = httpx.Timeout(timeout or self.timeouts.get(endpoint, 10), connect=self.connect_timeout)
+
+        try:
+            for attempt in range(self.max_retries + 1):
+                retries_left = attempt < self.max_retries
+                started = time.perf_counter()
+                try:
+                    response = await client.get(path, params=params, timeout=timeout)
+                except httpx.TransportError as e:
+                    self._record(endpoint, started, error=True)
+                    if retries_left:
+                        logger.warning(f"Mapbox {endpoint} request failed ({e}), retrying")
+                        await asyncio.sleep(self.backoff(attempt))
+                        continue
+                    breaker.record_failure()
+                    if isinstance(e, httpx.TimeoutException):
+                        raise requests.Timeout(str(e)) from e
+                    raise requests.ConnectionError(str(e)) from e
+
+                failed = response.status_code in RETRY_STATUSES
+                self._record(endpoint, started, error=failed)
+                if failed and retries_left:
+                    logger.warning(f"Mapbox {endpoint} returned {response.status_code}, retrying")
+                    await asyncio.sleep(self.backoff(attempt, response))
+                    continue
+
+                if failed:
+                    breaker.record_failure()
+                    raise requests.HTTPError(f"{response.status_code} error from Mapbox {endpoint}")
+                if response.is_error:
+                    # Client errors (4xx other than 429) say nothing about Mapbox's health
+                    breaker.record_success()
+                    raise requests.HTTPError(f"{response.status_code} error from Mapbox {endpoint}")
+                return self._decode(endpoint, breaker, response)
+        except requests.RequestException:
+            raise
+        except BaseException:
+            # Cancelled, or failed before an outcome was recorded: free the trial
+            # slot, or the circuit would stay half-open with no trial ever allowed
+            breaker.release()
+            raise
@@ -0,0 +1,250 @@
+"""
+Request timing and Prometheus metrics.
+
+``timed(stage)`` times a block of the planning pipeline. Mapbox calls and DB
+queries are timed where they happen (MapboxClient, a connection execute
+wrapper). Every measurement feeds a process-wide histogram, rendered in the
+Prometheus text format by the metrics view, and the timings of the current
+request, which ServerTimingMiddleware returns as a ``Server-Timing`` header.
+
+Metrics are per process: under several workers each one reports its own.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250, 500)
+
+REGISTRY = []
+
+
+class Histogram:
+    """A labelled Prometheus histogram, safe to observe from any thread."""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [per-bucket counts, sum, count]
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, *labelvalues):
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * len(self.buckets), 0.0, 0]
+            if bucket < len(self.buckets):
+                series[0][bucket] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        with self._lock:
+            series = sorted((labels, (list(counts), total, count))
+                            for labels, (counts, total, count) in self._series.items())
+
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labelvalues, (counts, total, count) in series:
+            labels = _labels(self.labelnames, labelvalues)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = _join(labels, "le=" + _quote(bound))
+                lines.append(f"{self.name}_bucket{{{le}}} {cumulative}")
+            le = _join(labels, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{{{le}}} {count}")
+            suffix = f"{{{labels}}}" if labels else ""
+            lines.append(f"{self.name}_sum{suffix} {total}")
+            lines.append(f"{self.name}_count{suffix} {count}")
+        return "\n".join(lines)
+
+
+class Counter:
+    """A labelled Prometheus counter, safe to increment from any thread."""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+        return render_gauge(self.name, self.documentation, self.labelnames, values, metric_type="counter")
+
+
+def render_gauge(name, documentation, labelnames, values, metric_type="gauge"):
+    """Renders a gauge (or ``metric_type``) computed at scrape time from {label values: value}."""
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {metric_type}"]
+    for labelvalues, value in sorted(values.items()):
+        labels = _labels(labelnames, labelvalues)
+        lines.append(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}")
+    return "\n".join(lines)
+
+
+def render():
+    return "\n".join(metric.render() for metric in REGISTRY)
+
+
+def _quote(value):
+    text = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return f'"{text}"'
+
+
+def _labels(labelnames, labelvalues):
+    return ",".join(f"{name}={_quote(value)}" for name, value in zip(labelnames, labelvalues))
+
+
+def _join(*parts):
+    return ",".join(part for part in parts if part)
+
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "trips_http_request_duration_seconds", "Time to handle an API request.", ("view", "method", "status"))
+STAGE_SECONDS = Histogram(
+    "trips_planning_stage_duration_seconds", "Time spent in each trip planning stage.", ("stage",))
+MAPBOX_REQUEST_SECONDS = Histogram(
+    "trips_mapbox_request_duration_seconds", "Time per Mapbox HTTP request (each retry counts).",
+    ("endpoint", "outcome"))
+DB_QUERY_SECONDS = Histogram("trips_db_query_duration_seconds", "Time per database query.")
+DB_QUERIES_PER_REQUEST = Histogram(
+    "trips_db_queries_per_request", "Database queries run while handling an API request.", ("view",),
+    buckets=QUERY_COUNT_BUCKETS)
+DB_CONNECTIONS = Counter(
+    "trips_db_connections_total",
+    "Database connections set up (opened, or taken from the pool when DB_POOL is on).", ("database",))
+
+# psycopg_pool get_stats() keys rendered for each pool: (metric, stat, type, help)
+DB_POOL_STATS = (
+    ("trips_db_pool_max", "pool_max", "gauge", "Most connections the pool may open."),
+    ("trips_db_pool_size", "pool_size", "gauge", "Connections open or being opened."),
+    ("trips_db_pool_available", "pool_available", "gauge", "Idle connections ready to be handed out."),
+    ("trips_db_pool_waiting", "requests_waiting", "gauge", "Requests waiting for a connection right now."),
+    ("trips_db_pool_requests_total", "requests_num", "counter", "Connections requested from the pool."),
+    ("trips_db_pool_requests_queued_total", "requests_queued", "counter",
+     "Connection requests that had to wait for a free connection."),
+    ("trips_db_pool_timeouts_total", "requests_errors", "counter",
+     "Connection requests that timed out or failed."),
+)
+
+
+def render_db_pools(pool_stats):
+    """
+    Renders connection pool saturation from {database alias: pool.get_stats()}.
+
+    A pool is saturated when ``trips_db_pool_available`` stays at 0 and
+    ``trips_db_pool_waiting`` or the queued/timeout counters grow.
+    """
+    lines = []
+    for metric, stat, metric_type, documentation in DB_POOL_STATS:
+        values = {(alias,): stats.get(stat, 0) for alias, stats in pool_stats.items()}
+        lines.append(render_gauge(metric, documentation, ("database",), values, metric_type=metric_type))
+    wait = {(alias,): stats.get("requests_wait_ms", 0) / 1000 for alias, stats in pool_stats.items()}
+    lines.append(render_gauge("trips_db_pool_wait_seconds_total", "Time spent waiting for a pooled connection.",
+                              ("database",), wait, metric_type="counter"))
+    return "\n".join(lines)
+
+
+class RequestTimings:
+    """Total time and count per timing name for one request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.totals = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self._lock:
+            total, count = self.totals.get(name, (0.0, 0))
+            self.totals[name] = (total + seconds, count + 1)
+
+    def count(self, name):
+        return self.totals.get(name, (0.0, 0))[1]
+
+    def server_timing(self):
+        entries = []
+        for name, (total, count) in self.totals.items():
+            entry = f"{name};dur={total * 1000:.1f}"
+            if count > 1:
+                entry += f';desc="{count} calls"'
+            entries.append(entry)
+        entries.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ", ".join(entries)
+
+
+_current_timings = ContextVar("request_timings", default=None)
+
+
+def start_request():
+    """Starts collecting timings for the current request; pass the token to finish_request."""
+    return _current_timings.set(RequestTimings())
+
+
+def finish_request(token):
+    timings = _current_timings.get()
+    _current_timings.reset(token)
+    return timings
+
+
+def record(name, seconds):
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.add(name, seconds)
+
+
+def submit_with_context(executor, fn, *args):
+    """
+    executor.submit(fn, *args), run in a copy of the caller's context.
+
+    Pool threads do not inherit context variables, so without the copy the
+    Mapbox calls and queries a task makes would be missing from the
+    request's timings.
+    """
+    return executor.submit(copy_context().run, fn, *args)
+
+
+@contextmanager
+def timed(stage):
+    """Times a planning stage into the stage histogram and the current request's Server-Timing."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage)
+        record(stage, elapsed)
+
+
+def observe_mapbox(endpoint, seconds, error=False):
+    MAPBOX_REQUEST_SECONDS.observe(seconds, endpoint, "error" if error else "ok")
+    record(f"mapbox-{endpoint}", seconds)
+
+
+def _time_query(execute, sql, params, many, context):
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        DB_QUERY_SECONDS.observe(elapsed)
+        record("db", elapsed)
+
+
+def instrument_connection(sender, connection, **kwargs):
+    """connection_created receiver: counts the connection and times every query run on it."""
+    DB_CONNECTIONS.inc(connection.alias)
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
@@ -0,0 +1,48 @@
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from . import metrics
+
+
+class ServerTimingMiddleware:
+    """
+    Times every request: adds a ``Server-Timing`` header with the stage, Mapbox
+    and DB timings collected while handling it, and records the request
+    duration and query count in the Prometheus histograms.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = metrics.start_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            timings = metrics.finish_request(token)
+        return self.finish(request, response, timings)
+
+    async def __acall__(self, request):
+        token = metrics.start_request()
+        try:
+            response = await self.get_response(request)
+        finally:
+            timings = metrics.finish_request(token)
+        return self.finish(request, response, timings)
+
+    def finish(self, request, response, timings):
+        match = request.resolver_match
+        view = match.url_name if match and match.url_name else "unmatched"
+        metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - timings.started,
+                                             view, request.method, str(response.status_code))
+        metrics.DB_QUERIES_PER_REQUEST.observe(timings.count("db"), view)
+        if settings.SERVER_TIMING_HEADER:
+            response["Server-Timing"] = timings.server_timing()
+        return response
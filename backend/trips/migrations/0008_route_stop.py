@@ -0,0 +1,45 @@
+# Generated by Django 5.1.6 on 2026-10-17 06:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0007_trip_trip_created_id_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Route',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('distance_miles', models.FloatField()),
+                ('driving_hours', models.FloatField()),
+                ('total_hours', models.FloatField()),
+                ('polyline', models.TextField()),
+                ('polyline_precision', models.PositiveSmallIntegerField(default=6)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('trip', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='route', to='trips.trip')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Stop',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sequence', models.PositiveIntegerField()),
+                ('stop_type', models.CharField(choices=[('fuel', 'Fuel'), ('rest', 'Rest'), ('pickup', 'Pickup'), ('dropoff', 'Dropoff')], max_length=50)),
+                ('name', models.CharField(max_length=255)),
+                ('icon', models.CharField(default='marker', max_length=50)),
+                ('latitude', models.FloatField(null=True)),
+                ('longitude', models.FloatField(null=True)),
+                ('mile_marker', models.FloatField(null=True)),
+                ('route', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stops', to='trips.route')),
+            ],
+            options={
+                'ordering': ['sequence'],
+                'constraints': [models.UniqueConstraint(fields=('route', 'sequence'), name='unique_stop_sequence')],
+            },
+        ),
+    ]
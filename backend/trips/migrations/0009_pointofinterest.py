@@ -0,0 +1,24 @@
+# Generated by Django 5.1.6 on 2026-10-17 06:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0008_route_stop'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PointOfInterest',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('category', models.CharField(choices=[('gas_station', 'Gas station'), ('truck_stop', 'Truck stop'), ('hotel', 'Hotel')], max_length=32)),
+                ('latitude', models.FloatField()),
+                ('longitude', models.FloatField()),
+                ('source', models.CharField(blank=True, max_length=100)),
+            ],
+        ),
+    ]
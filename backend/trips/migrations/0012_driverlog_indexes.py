@@ -0,0 +1,27 @@
+# Generated by Django 5.1.6 on 2026-10-17 06:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0011_trip_updated_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='driverlog',
+            name='trip',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='logs', to='trips.trip'),
+        ),
+        migrations.AddIndex(
+            model_name='driverlog',
+            index=models.Index(fields=['trip', 'date'], name='log_trip_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='driverlog',
+            index=models.Index(fields=['date', 'id'], name='log_date_id_idx'),
+        ),
+    ]
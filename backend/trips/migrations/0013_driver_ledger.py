@@ -0,0 +1,33 @@
+# Generated by Django 5.1.6 on 2026-10-17 06:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0012_driverlog_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Driver',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('duty_hours', models.JSONField(default=dict)),
+                ('restart_dates', models.JSONField(default=list)),
+                ('cycle_hours', models.FloatField(default=0)),
+                ('cycle_date', models.DateField(blank=True, null=True)),
+                ('last_duty_date', models.DateField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='driver',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='trips', to='trips.driver'),
+        ),
+    ]
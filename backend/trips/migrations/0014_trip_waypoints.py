@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-17 06:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0013_driver_ledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trip',
+            name='waypoints',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -1,39 +1,158 @@
+import uuid
 from django.db import models
 
 
+class Driver(models.Model):
+    """A driver and their rolling 70-hour/8-day cycle ledger, maintained by trips.ledger."""
+    name = models.CharField(max_length=255)
+    # On-duty hours per ISO date, from the start of the current 8-day window (planned days included)
+    duty_hours = models.JSONField(default=dict)
+    restart_dates = models.JSONField(default=list)  # ISO dates of 34-hour restarts in that range
+    # Rolling cycle total as of cycle_date, written with the ledger
+    cycle_hours = models.FloatField(default=0)
+    cycle_date = models.DateField(null=True, blank=True)
+    last_duty_date = models.DateField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
+
+
 class Trip(models.Model):
+    # When set, cycle_hours comes from the driver's ledger instead of the client
+    driver = models.ForeignKey(Driver, related_name='trips', null=True, blank=True,
+                               on_delete=models.SET_NULL)
     current_location = models.CharField(max_length=255)
     pickup_location = models.CharField(max_length=255)
     dropoff_location = models.CharField(max_length=255)
+    # Extra pickups/drop-offs visited in order between pickup_location and dropoff_location
+    waypoints = models.JSONField(default=list, blank=True)
     cycle_hours = models.IntegerField()
     sleeper_berth_hours = models.FloatField(default=0)
     cycle_start_date = models.DateField(auto_now_add=True)
     cycle_hours_remaining = models.DecimalField(max_digits=4, decimal_places=1, default=70)
     violations = models.JSONField(default=list)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Bumped whenever the trip or its logs change; the version behind get_trip_by_id's ETag
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination in get_all_trips seeks on (created_at, id)
+            models.Index(fields=['-created_at', '-id'], name='trip_created_id_idx'),
+        ]
 
     def __str__(self):
         return f"Trip from {self.pickup_location} to {self.dropoff_location}"
 
 
-# class Route(models.Model):
-#     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-#     trip = models.ForeignKey(
-#         Trip, related_name='routes', on_delete=models.CASCADE)
-#     step_number = models.IntegerField()
-#     location_name = models.CharField(max_length=255)
-#     latitude = models.FloatField()
-#     longitude = models.FloatField()
-#     stop_type = models.CharField(max_length=50, choices=[(
-#         'fuel', 'Fuel'), ('rest', 'Rest'), ('pickup', 'Pickup'), ('dropoff', 'Dropoff')])
-#     timestamp = models.DateTimeField()
+class Route(models.Model):
+    """A trip's planned route, stored so trip details never need Mapbox again."""
+    trip = models.OneToOneField(Trip, related_name='route', on_delete=models.CASCADE)
+    distance_miles = models.FloatField()
+    driving_hours = models.FloatField()
+    total_hours = models.FloatField()
+    # Full route geometry as an encoded polyline (ROUTE_STORAGE_PRECISION digits)
+    polyline = models.TextField()
+    polyline_precision = models.PositiveSmallIntegerField(default=6)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Route for trip {self.trip_id}"
+
+
+class Stop(models.Model):
+    route = models.ForeignKey(Route, related_name='stops', on_delete=models.CASCADE)
+    sequence = models.PositiveIntegerField()
+    stop_type = models.CharField(max_length=50, choices=[(
+        'fuel', 'Fuel'), ('rest', 'Rest'), ('pickup', 'Pickup'), ('dropoff', 'Dropoff')])
+    name = models.CharField(max_length=255)
+    icon = models.CharField(max_length=50, default='marker')
+    latitude = models.FloatField(null=True)
+    longitude = models.FloatField(null=True)
+    mile_marker = models.FloatField(null=True)  # distance from the route start
+
+    class Meta:
+        ordering = ['sequence']
+        constraints = [
+            models.UniqueConstraint(fields=['route', 'sequence'], name='unique_stop_sequence'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_stop_type_display()} stop: {self.name}"
 
 
 class DriverLog(models.Model):
+    # The (trip, date) index below also serves lookups by trip alone
     trip = models.ForeignKey(Trip, related_name='logs',
-                             on_delete=models.CASCADE)
+                             on_delete=models.CASCADE, db_index=False)
     date = models.DateField()
     off_duty_hours = models.FloatField()
     sleeper_berth_hours = models.FloatField()
     driving_hours = models.FloatField()
     on_duty_hours = models.FloatField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['trip', 'date'], name='log_trip_date_idx'),
+            # Date-range queries in get_logs seek on (date, id)
+            models.Index(fields=['date', 'id'], name='log_date_id_idx'),
+        ]
+
+
+class LookupCacheEntry(models.Model):
+    """A cached external lookup (geocode, reverse geocode, ...) shared by all workers."""
+    namespace = models.CharField(max_length=32)
+    key = models.CharField(max_length=64, unique=True)  # sha1 of namespace + normalized query
+    query = models.TextField()
+    value = models.JSONField()
+    hits = models.PositiveIntegerField(default=0)
+    misses = models.PositiveIntegerField(default=0)
+    fetched_at = models.DateTimeField()
+    last_used_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.namespace}: {self.query}"
+
+
+class PointOfInterest(models.Model):
+    """Offline POI dataset (fuel stations, truck stops, hotels) loaded with `manage.py load_pois`."""
+    CATEGORY_CHOICES = [
+        ('gas_station', 'Gas station'),
+        ('truck_stop', 'Truck stop'),
+        ('hotel', 'Hotel'),
+    ]
+
+    name = models.CharField(max_length=255)
+    category = models.CharField(max_length=32, choices=CATEGORY_CHOICES)
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    source = models.CharField(max_length=100, blank=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.category})"
+
+
+class PlanningJob(models.Model):
+    """A trip planned in the background (create_trip with ?async=true)."""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    trip = models.ForeignKey(Trip, related_name='planning_jobs', on_delete=models.CASCADE)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default='queued')
+    stage = models.CharField(max_length=32, blank=True)
+    progress = models.PositiveSmallIntegerField(default=0)  # percent
+    result = models.JSONField(null=True, blank=True)  # the create_trip payload once succeeded
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Planning job {self.id} ({self.status})"
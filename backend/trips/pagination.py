@@ -0,0 +1,80 @@
+import base64
+import datetime
+import json
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(values):
+    # isoformat() keeps microseconds; DjangoJSONEncoder would cut datetimes to
+    # milliseconds and the seek would skip rows created in the same millisecond
+    values = [value.isoformat() if isinstance(value, datetime.date) else value for value in values]
+    raw = json.dumps(values, cls=DjangoJSONEncoder, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor("Invalid cursor") from e
+
+
+def parse_page_size(value, default, maximum):
+    """Parses a ``page_size`` query parameter, clamped to 1..maximum."""
+    if value in (None, ""):
+        return default
+    try:
+        return max(1, min(int(value), maximum))
+    except ValueError:
+        raise ValueError("page_size must be an integer") from None
+
+
+def keyset_page(queryset, fields, cursor, page_size, descending=True):
+    """
+    Returns one page of ``queryset`` ordered by ``fields`` plus the cursor of the next page.
+
+    Seeks past the last row of the previous page with a row-value comparison
+    instead of an OFFSET, so every page costs the same no matter how deep it is.
+    ``fields`` must end with a unique column (usually ``id``).
+
+    Returns:
+        tuple: (list of objects, next cursor or None)
+    """
+    direction = "lt" if descending else "gt"
+    queryset = queryset.order_by(*[f"-{field}" if descending else field for field in fields])
+
+    if cursor:
+        values = _cursor_values(queryset.model, fields, decode_cursor(cursor))
+        # (a, b) < (x, y)  <=>  a < x OR (a = x AND b < y)
+        seek = Q()
+        for i, field in enumerate(fields):
+            equal = {prefix: values[j] for j, prefix in enumerate(fields[:i])}
+            seek |= Q(**equal, **{f"{field}__{direction}": values[i]})
+        queryset = queryset.filter(seek)
+
+    rows = list(queryset[:page_size + 1])
+    if len(rows) <= page_size:
+        return rows, None
+
+    rows = rows[:page_size]
+    last = rows[-1]
+    return rows, encode_cursor([getattr(last, field) for field in fields])
+
+
+def _cursor_values(model, fields, values):
+    """Converts decoded cursor values to the types of ``fields``; raises InvalidCursor if they do not fit."""
+    if not isinstance(values, list) or len(values) != len(fields):
+        raise InvalidCursor("Invalid cursor")
+    try:
+        values = [model._meta.get_field(field).to_python(value) for field, value in zip(fields, values)]
+    except (ValidationError, TypeError, ValueError) as e:
+        raise InvalidCursor("Invalid cursor") from e
+    if any(value is None for value in values):
+        raise InvalidCursor("Invalid cursor")
+    return values
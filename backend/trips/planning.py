@@ -0,0 +1,224 @@
+"""
+The trip planning pipeline: route, stops, HOS schedule and persistence.
+
+Shared by the create_trip views and the background planning jobs.
+"""
+import logging
+import math
+from datetime import date
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from .geometry import decode_polyline, encode_polyline, simplify, tolerance_for_zoom
+from .hos import schedule_duty_days
+from .ledger import apply_cycle_hours, lock_drivers, record_duty
+from .metrics import timed
+from .models import DriverLog as Log, Route, Stop
+from .serializers import TripSerializer, LogSerializer, StopSerializer
+from .routing import aget_route, get_route, trip_points
+from .services import calculate_trip_details, calculate_stops, acalculate_stops, check_compliance
+
+logger = logging.getLogger("django")
+
+# Web map zoom levels accepted by ?zoom=
+MIN_ZOOM, MAX_ZOOM = 0, 24
+
+
+class PlanningError(Exception):
+    """The trip could not be planned (e.g. Mapbox found no route)."""
+
+
+def _no_progress(stage, percent):
+    pass
+
+
+def plan_trip(trip, geometry_options, refresh=False, progress=_no_progress):
+    """
+    Plans a saved trip end to end and returns the create_trip response payload.
+
+    ``progress(stage, percent)`` is called as the pipeline moves through its stages.
+    """
+    progress("routing", 10)
+    with timed("routing"):
+        route_data = get_route(trip_points(trip), refresh=refresh)
+    if route_data is None:
+        raise PlanningError("No route found between the trip locations")
+    driving_hours, total_hours, total_miles = calculate_trip_details(
+        route_data, trip.cycle_hours
+    )
+
+    progress("stops", 40)
+    with timed("stops"):
+        route = route_data["routes"][0]
+        stops = calculate_stops(total_miles, total_hours, route["geometry"], route.get("legs"))
+
+    progress("scheduling", 80)
+    payload = persist_plan(trip, route_data, driving_hours, total_hours, total_miles, stops, geometry_options)
+    progress("done", 100)
+    return payload
+
+
+async def aplan_trip(trip, geometry_options, refresh=False):
+    """Async version of plan_trip."""
+    with timed("routing"):
+        route_data = await aget_route(trip_points(trip), refresh=refresh)
+    if route_data is None:
+        raise PlanningError("No route found between the trip locations")
+    driving_hours, total_hours, total_miles = calculate_trip_details(
+        route_data, trip.cycle_hours
+    )
+    with timed("stops"):
+        route = route_data["routes"][0]
+        stops = await acalculate_stops(total_miles, total_hours, route["geometry"], route.get("legs"))
+
+    return await sync_to_async(persist_plan)(trip, route_data, driving_hours, total_hours, total_miles, stops,
+                                             geometry_options)
+
+
+def parse_geometry_options(params):
+    """
+    Reads how the route geometry should be returned from the query params.
+
+    ``geometry``: ``geojson`` (simplified LineString, default), ``polyline``
+    (simplified, encoded polyline) or ``full`` (Mapbox geometry as-is).
+    ``zoom`` picks a tolerance of about one pixel at that zoom level;
+    ``tolerance`` sets it in meters.
+    """
+    geometry_format = params.get("geometry", "geojson").lower()
+    if geometry_format not in ("geojson", "polyline", "full"):
+        raise ValueError("geometry must be one of: geojson, polyline, full")
+
+    zoom, tolerance = None, settings.ROUTE_SIMPLIFY_TOLERANCE
+    try:
+        if params.get("zoom"):
+            zoom = float(params["zoom"])
+        elif params.get("tolerance"):
+            tolerance = float(params["tolerance"])
+    except ValueError:
+        raise ValueError("zoom and tolerance must be numbers") from None
+    if zoom is not None:
+        # Also rejects nan; far out-of-range zooms overflow or divide by zero
+        if not MIN_ZOOM <= zoom <= MAX_ZOOM:
+            raise ValueError(f"zoom must be between {MIN_ZOOM} and {MAX_ZOOM}")
+        tolerance = tolerance_for_zoom(zoom)
+    if not math.isfinite(tolerance) or tolerance < 0:
+        raise ValueError("tolerance must be a finite, non-negative number")
+
+    return geometry_format, tolerance
+
+
+def route_geometry(geometry, geometry_options):
+    geometry_format, tolerance = geometry_options
+    if geometry_format == "full":
+        return geometry
+
+    coordinates = simplify(geometry["coordinates"], tolerance)
+    if geometry_format == "polyline":
+        precision = settings.ROUTE_POLYLINE_PRECISION
+        return {"polyline": encode_polyline(coordinates, precision), "precision": precision}
+    return {"type": "LineString", "coordinates": coordinates}
+
+
+def persist_plan(trip, route_data, driving_hours, total_hours, total_miles, stops, geometry_options):
+    """
+    Persists the trip's duty-day logs, route and stops and returns the create_trip response payload.
+
+    A trip with a driver is scheduled after the driver's planned days, with
+    the cycle hours read under the driver's row lock, which is held until its
+    duty days are in the ledger.
+    """
+    _, _, fuel_locations, rest_locations = stops
+    geometry = route_data["routes"][0]["geometry"]
+
+    with transaction.atomic():
+        with timed("hos"):
+            driver = lock_drivers([trip.driver_id]).get(trip.driver_id) if trip.driver_id else None
+            first_day = None
+            if driver is not None:
+                first_day = apply_cycle_hours(trip, driver)
+                trip.save(update_fields=["cycle_hours", "cycle_hours_remaining", "updated_at"])
+            log_entries = build_logs(trip, driving_hours, first_day)
+        with timed("db_write"):
+            Log.objects.bulk_create(log_entries)
+            if driver is not None:
+                record_duty(driver, log_entries)
+            route = Route.objects.create(**route_fields(trip, geometry, driving_hours, total_hours, total_miles))
+            route_stops = Stop.objects.bulk_create(build_stops(route, fuel_locations, rest_locations))
+            check_compliance(trip, log_entries)
+
+    with timed("serialize"):
+        return {
+            "trip": TripSerializer(trip).data,
+            **route_payload(route, route_stops, geometry_options, geometry=geometry),
+            "logs": LogSerializer(log_entries, many=True).data,
+        }
+
+
+def build_logs(trip, driving_hours, start_date=None):
+    """Unsaved DriverLog rows for the trip's scheduled duty days, from ``start_date`` (default today)."""
+    return [
+        Log(
+            trip=trip,
+            date=duty_day.date,
+            driving_hours=duty_day.driving_hours,
+            on_duty_hours=duty_day.on_duty_hours,
+            off_duty_hours=duty_day.off_duty_hours,
+            sleeper_berth_hours=duty_day.sleeper_berth_hours,
+        )
+        for duty_day in schedule_duty_days(driving_hours, trip.cycle_hours, start_date=start_date or date.today())
+    ]
+
+
+def route_fields(trip, geometry, driving_hours, total_hours, total_miles):
+    precision = settings.ROUTE_STORAGE_PRECISION
+    return {
+        "trip": trip,
+        "distance_miles": total_miles,
+        "driving_hours": driving_hours,
+        "total_hours": total_hours,
+        "polyline": encode_polyline(geometry["coordinates"], precision),
+        "polyline_precision": precision,
+    }
+
+
+def build_stops(route, fuel_locations, rest_locations):
+    """Unsaved Stop rows for a route, numbered in mile order."""
+    located = [("fuel", location) for location in fuel_locations]
+    located += [("rest", location) for location in rest_locations]
+    located.sort(key=lambda item: item[1].get("mile_marker") or 0)
+    return [
+        Stop(
+            route=route,
+            sequence=sequence,
+            stop_type=stop_type,
+            name=str(location.get("name") or "Unknown")[:255],
+            icon=location.get("icon") or "marker",
+            longitude=location["coords"][0] if location.get("coords") else None,
+            latitude=location["coords"][1] if location.get("coords") else None,
+            mile_marker=location.get("mile_marker"),
+        )
+        for sequence, (stop_type, location) in enumerate(located)
+    ]
+
+
+def route_payload(route, stops, geometry_options, geometry=None):
+    """The route_info/stops/route_geometry part of a trip response, built from a stored Route."""
+    if geometry is None:
+        geometry = {"type": "LineString",
+                    "coordinates": decode_polyline(route.polyline, route.polyline_precision)}
+
+    fuel_locations = StopSerializer([stop for stop in stops if stop.stop_type == "fuel"], many=True).data
+    rest_locations = StopSerializer([stop for stop in stops if stop.stop_type == "rest"], many=True).data
+    return {
+        "route_info": {
+            "distance": f"{route.distance_miles:.2f} miles",
+            "duration": f"{route.total_hours:.2f} hours"
+        },
+        "stops": {
+            "fuel_stops": len(fuel_locations),
+            "rest_stops": len(rest_locations),
+            "fuel_stop_locations": fuel_locations,
+            "rest_stop_locations": rest_locations
+        },
+        "route_geometry": route_geometry(geometry, geometry_options)
+    }
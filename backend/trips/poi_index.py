@@ -0,0 +1,151 @@
+import logging
+import math
+import threading
+import time
+from collections import defaultdict
+import numpy as np
+from django.conf import settings
+from django.db.models import Count, Max
+from .geometry import haversine_miles
+from .models import PointOfInterest
+
+logger = logging.getLogger("django")
+
+MILES_PER_DEGREE_LAT = 69.0
+
+# Mapbox category used by the planner -> local categories that can serve it
+POI_TYPE_CATEGORIES = {
+    'gas_station': ('gas_station', 'truck_stop'),
+    'hotel': ('hotel', 'truck_stop'),
+}
+CATEGORY_ICONS = {
+    'gas_station': 'fuel',
+    'truck_stop': 'fuel',
+    'hotel': 'lodging',
+}
+
+
+class POIIndex:
+    """
+    In-memory grid index over the offline POI table.
+
+    POIs are bucketed into square cells of ``cell_degrees``; a lookup only
+    measures distances to POIs in the cells around the part of the route it
+    is searching.
+    """
+
+    def __init__(self, names, categories, latitudes, longitudes, cell_degrees=0.25):
+        self.names = list(names)
+        self.categories = np.asarray(categories, dtype=object)
+        self.latitudes = np.asarray(latitudes, dtype=float)
+        self.longitudes = np.asarray(longitudes, dtype=float)
+        self.cell_degrees = cell_degrees
+        self.version = None
+
+        cells = defaultdict(list)
+        rows = np.floor(self.latitudes / cell_degrees).astype(int)
+        cols = np.floor(self.longitudes / cell_degrees).astype(int)
+        for i, cell in enumerate(zip(rows.tolist(), cols.tolist())):
+            cells[cell].append(i)
+        self.cells = {cell: np.array(members) for cell, members in cells.items()}
+
+    @classmethod
+    def from_database(cls, cell_degrees=0.25):
+        rows = list(PointOfInterest.objects.values_list("name", "category", "latitude", "longitude"))
+        columns = list(zip(*rows)) if rows else ([], [], [], [])
+        return cls(*columns, cell_degrees=cell_degrees)
+
+    def __len__(self):
+        return len(self.names)
+
+    def _candidates(self, min_lat, max_lat, min_lon, max_lon, categories):
+        size = self.cell_degrees
+        found = [
+            self.cells[(row, col)]
+            for row in range(math.floor(min_lat / size), math.floor(max_lat / size) + 1)
+            for col in range(math.floor(min_lon / size), math.floor(max_lon / size) + 1)
+            if (row, col) in self.cells
+        ]
+        if not found:
+            return np.array([], dtype=int)
+        candidates = np.concatenate(found)
+        return candidates[np.isin(self.categories[candidates], categories)]
+
+    def best_along_route(self, route_index, mile, poi_type, corridor_miles, window_miles):
+        """
+        Finds the best POI for a stop planned at ``mile`` along a route.
+
+        Searches the stretch of route within ``window_miles`` of the target for
+        POIs no more than ``corridor_miles`` off the route, and picks the one
+        with the smallest (distance from the target mile + detour there and back).
+
+        Returns:
+            dict: {"name", "icon", "coords"} like find_nearest_poi, or None
+        """
+        if not len(self):
+            return None
+
+        # Sample the route at most half a corridor apart so no POI in the corridor is missed
+        step = max(corridor_miles / 2, 0.1)
+        start = max(0.0, mile - window_miles)
+        end = min(route_index.total_miles, mile + window_miles)
+        sample_miles = np.append(np.arange(start, end, step), end)
+        samples = np.asarray(route_index.points_at_miles(sample_miles))
+        sample_lons, sample_lats = samples[:, 0], samples[:, 1]
+
+        lat_margin = corridor_miles / MILES_PER_DEGREE_LAT
+        max_abs_lat = min(89.0, float(np.abs(sample_lats).max()) + lat_margin)
+        lon_margin = lat_margin / math.cos(math.radians(max_abs_lat))
+        candidates = self._candidates(
+            sample_lats.min() - lat_margin, sample_lats.max() + lat_margin,
+            sample_lons.min() - lon_margin, sample_lons.max() + lon_margin,
+            POI_TYPE_CATEGORIES.get(poi_type, (poi_type,)),
+        )
+        if not len(candidates):
+            return None
+
+        distances = haversine_miles(self.latitudes[candidates][:, None], self.longitudes[candidates][:, None],
+                                    sample_lats[None, :], sample_lons[None, :])
+        nearest = distances.argmin(axis=1)
+        offsets = distances[np.arange(len(candidates)), nearest]
+        scores = np.abs(sample_miles[nearest] - mile) + 2 * offsets
+        scores[offsets > corridor_miles] = np.inf
+
+        best = int(scores.argmin())
+        if not np.isfinite(scores[best]):
+            return None
+
+        poi = int(candidates[best])
+        return {
+            "name": self.names[poi],
+            "icon": CATEGORY_ICONS.get(self.categories[poi], "marker"),
+            "coords": [float(self.longitudes[poi]), float(self.latitudes[poi])],
+        }
+
+
+_index = None
+_index_checked_at = 0.0
+_index_lock = threading.Lock()
+
+
+def get_poi_index():
+    """
+    Returns the process-wide POIIndex, rebuilding it when the POI table changed.
+
+    The table is only re-checked every POI_INDEX_REFRESH seconds, so a reload
+    with `load_pois` reaches every worker within that interval.
+    """
+    global _index, _index_checked_at
+    with _index_lock:
+        now = time.monotonic()
+        if _index is not None and now - _index_checked_at < settings.POI_INDEX_REFRESH:
+            return _index
+
+        version = PointOfInterest.objects.aggregate(count=Count("id"), last=Max("id"))
+        if _index is None or _index.version != version:
+            started = time.perf_counter()
+            _index = POIIndex.from_database(settings.POI_INDEX_CELL_DEGREES)
+            _index.version = version
+            logger.info(f"Built POI index with {len(_index)} POIs in {time.perf_counter() - started:.2f}s")
+        _index_checked_at = now
+        return _index
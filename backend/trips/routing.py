@@ -0,0 +1,183 @@
+"""
+Multi-stop routes.
+
+A start/pickup/dropoff lane is one Directions request, cached as a whole by
+get_route_details. Longer routes are cached leg by leg, so editing one stop
+only re-plans the legs touching it. Missing legs are fetched in chunks of at
+most DIRECTIONS_MAX_WAYPOINTS waypoints (the Mapbox limit per request);
+consecutive chunks share their boundary waypoint and run in parallel. The
+legs are then merged back into one route, shaped like _parse_route's.
+"""
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from .caching import LookupCache, normalize_coordinate
+from .metrics import submit_with_context
+from .services import (
+    ROUTE_CACHE_VERSION, _parse_route, _route_request, aget_route_details, get_route_details, mapbox,
+)
+
+logger = logging.getLogger("django")
+
+leg_cache = LookupCache("route_leg", settings.ROUTE_CACHE_TTL, settings.ROUTE_CACHE_MAX_ENTRIES)
+
+
+def trip_points(trip):
+    """The locations a trip visits, in order: current, pickup, extra stops, dropoff."""
+    return [trip.current_location, trip.pickup_location, *trip.waypoints, trip.dropoff_location]
+
+
+def get_route(points, refresh=False):
+    """Route data through ``points`` in order, or None when Mapbox finds no route."""
+    if len(points) == 3:
+        return get_route_details(*points, refresh=refresh)
+    return get_multi_stop_route(points, refresh=refresh)
+
+
+async def aget_route(points, refresh=False):
+    """Async version of get_route."""
+    if len(points) == 3:
+        return await aget_route_details(*points, refresh=refresh)
+    return await aget_multi_stop_route(points, refresh=refresh)
+
+
+def get_multi_stop_route(points, refresh=False):
+    """Routes through any number of points, fetching only the legs that are not cached."""
+    keys = _leg_keys(points)
+    legs = [None] * len(keys) if refresh else leg_cache.get_many(keys)
+    chunks = _leg_chunks([i for i, leg in enumerate(legs) if leg is None], settings.DIRECTIONS_MAX_WAYPOINTS)
+
+    if len(chunks) == 1:
+        fetched = [_fetch_legs(_chunk_points(points, chunks[0]))]
+    elif chunks:
+        with ThreadPoolExecutor(max_workers=min(settings.DIRECTIONS_WORKERS, len(chunks)),
+                                thread_name_prefix="directions") as executor:
+            futures = [submit_with_context(executor, _fetch_legs, _chunk_points(points, chunk)) for chunk in chunks]
+            fetched = [future.result() for future in futures]
+    else:
+        fetched = []
+
+    leg_cache.set_many(_fill_legs(legs, keys, chunks, fetched))
+    return _merge_legs(legs)
+
+
+async def aget_multi_stop_route(points, refresh=False):
+    """Async version of get_multi_stop_route."""
+    keys = _leg_keys(points)
+    legs = [None] * len(keys) if refresh else await sync_to_async(leg_cache.get_many)(keys)
+    chunks = _leg_chunks([i for i, leg in enumerate(legs) if leg is None], settings.DIRECTIONS_MAX_WAYPOINTS)
+    semaphore = asyncio.Semaphore(settings.DIRECTIONS_WORKERS)
+
+    async def fetch(chunk):
+        async with semaphore:
+            return await _afetch_legs(_chunk_points(points, chunk))
+
+    fetched = await asyncio.gather(*(fetch(chunk) for chunk in chunks))
+    await sync_to_async(leg_cache.set_many)(_fill_legs(legs, keys, chunks, fetched))
+    return _merge_legs(legs)
+
+
+def _fill_legs(legs, keys, chunks, fetched):
+    """Puts the fetched legs in place; returns them as (cache key, leg) pairs."""
+    filled = []
+    for chunk, chunk_legs in zip(chunks, fetched):
+        for i, leg in zip(chunk, chunk_legs or ()):
+            legs[i] = leg
+            filled.append((keys[i], leg))
+    return filled
+
+
+def _leg_keys(points):
+    normalized = [normalize_coordinate(point, settings.ROUTE_CACHE_PRECISION) for point in points]
+    return [f"v{ROUTE_CACHE_VERSION}|{start}|{end}" for start, end in zip(normalized, normalized[1:])]
+
+
+def _leg_chunks(missing, max_waypoints):
+    """Groups missing leg indexes into runs of consecutive legs, each spanning at most ``max_waypoints`` points."""
+    chunks = []
+    for i in missing:
+        if chunks and chunks[-1][-1] == i - 1 and len(chunks[-1]) < max_waypoints - 1:
+            chunks[-1].append(i)
+        else:
+            chunks.append([i])
+    return chunks
+
+
+def _chunk_points(points, chunk):
+    # Leg i runs from points[i] to points[i + 1]
+    return points[chunk[0]:chunk[-1] + 2]
+
+
+def _fetch_legs(points):
+    try:
+        return _parse_legs(mapbox.get(*_route_request(*points)), points)
+    except requests.RequestException as e:
+        logger.error(f"Mapbox API Error: {e}")
+        return None
+
+
+async def _afetch_legs(points):
+    try:
+        return _parse_legs(await mapbox.aget(*_route_request(*points)), points)
+    except requests.RequestException as e:
+        logger.error(f"Mapbox API Error: {e}")
+        return None
+
+
+def _parse_legs(data, points):
+    """Splits a Directions response into one cacheable route per leg."""
+    route_data = _parse_route(data)
+    if route_data is None:
+        return None
+    route = data["routes"][0]
+    if len(route.get("legs") or []) != len(points) - 1:
+        logger.error(f"Mapbox returned {len(route.get('legs') or [])} legs for {len(points)} waypoints")
+        return None
+
+    waypoints = [waypoint["location"] for waypoint in data.get("waypoints") or []]
+    if len(waypoints) != len(points):
+        waypoints = [[float(part) for part in point.split(",")] for point in points]
+    geometries = _split_geometry(route["geometry"]["coordinates"], waypoints)
+    return [
+        {"distance": leg["distance"], "duration": leg["duration"], "steps": parsed["steps"], "coordinates": coords}
+        for leg, parsed, coords in zip(route["legs"], route_data["routes"][0]["legs"], geometries)
+    ]
+
+
+def _split_geometry(coordinates, waypoints):
+    """
+    Cuts route coordinates at the interior waypoints, one list per leg.
+
+    Each cut is the first vertex on the snapped waypoint (Mapbox routes pass
+    through them) after the previous cut, or the nearest vertex if none is.
+    Adjacent legs share their boundary vertex.
+    """
+    coords = np.asarray(coordinates, dtype=float)
+    cuts = [0]
+    for lon, lat in waypoints[1:-1]:
+        remaining = coords[cuts[-1]:]
+        offsets = np.hypot(remaining[:, 0] - lon, remaining[:, 1] - lat)
+        on_waypoint = np.flatnonzero(offsets < 1e-6)
+        cuts.append(cuts[-1] + int(on_waypoint[0] if on_waypoint.size else np.argmin(offsets)))
+    cuts.append(len(coordinates) - 1)
+    return [coordinates[start:end + 1] for start, end in zip(cuts, cuts[1:])]
+
+
+def _merge_legs(legs):
+    if any(leg is None for leg in legs):
+        return None
+    coordinates = list(legs[0]["coordinates"])
+    for leg in legs[1:]:
+        coordinates += leg["coordinates"][1:]
+    return {
+        "routes": [{
+            "distance": sum(leg["distance"] for leg in legs),
+            "duration": sum(leg["duration"] for leg in legs),
+            "geometry": {"type": "LineString", "coordinates": coordinates},
+            "legs": [{"steps": leg["steps"]} for leg in legs],
+        }]
+    }
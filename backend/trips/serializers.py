@@ -1,5 +1,8 @@
+from django.conf import settings
 from rest_framework import serializers
-from .models import Trip, DriverLog
+from .ledger import availability, cycle_hours, start_date
+from .hos import CYCLE_LIMIT_HOURS
+from .models import Driver, Trip, DriverLog, PlanningJob, Stop
 
 
 class TripSerializer(serializers.ModelSerializer):
@@ -8,6 +11,25 @@ class TripSerializer(serializers.ModelSerializer):
     class Meta:
         model = Trip
         fields = '__all__'
+        extra_kwargs = {'cycle_hours': {'required': False}}
+
+    def validate(self, attrs):
+        driver = attrs.get('driver')
+        if driver is not None:
+            # The driver's ledger is authoritative; a client-sent cycle_hours is ignored.
+            # Planning reads it again under the driver's lock before scheduling.
+            attrs['cycle_hours'] = cycle_hours(driver, start_date(driver))
+            attrs['cycle_hours_remaining'] = max(0, CYCLE_LIMIT_HOURS - attrs['cycle_hours'])
+        elif attrs.get('cycle_hours') is None:
+            raise serializers.ValidationError({'cycle_hours': ['This field is required without a driver.']})
+        return attrs
+
+    def validate_waypoints(self, value):
+        if not isinstance(value, list) or not all(isinstance(point, str) and point.strip() for point in value):
+            raise serializers.ValidationError('Must be a list of locations.')
+        if len(value) > settings.TRIP_MAX_WAYPOINTS:
+            raise serializers.ValidationError(f'At most {settings.TRIP_MAX_WAYPOINTS} extra stops are allowed.')
+        return value
 
     def get_compliance_status(self, obj):
         return {
@@ -16,7 +38,95 @@ class TripSerializer(serializers.ModelSerializer):
             'cycle_start': obj.cycle_start_date
         }
 
+
+class DriverSerializer(serializers.ModelSerializer):
+    availability = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Driver
+        fields = ['id', 'name', 'availability', 'created_at']
+
+    def get_availability(self, obj):
+        return availability(obj)
+
+
 class LogSerializer(serializers.ModelSerializer):
     class Meta:
         model = DriverLog
         fields = '__all__'
+
+
+class TripWithLogsSerializer(TripSerializer):
+    logs = LogSerializer(many=True, read_only=True)
+
+
+class StopSerializer(serializers.ModelSerializer):
+    coords = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Stop
+        fields = ['name', 'icon', 'coords', 'mile_marker']
+
+    def get_coords(self, obj):
+        if obj.longitude is None or obj.latitude is None:
+            return None
+        return [obj.longitude, obj.latitude]
+
+
+class PlanningJobSerializer(serializers.ModelSerializer):
+    job_id = serializers.UUIDField(source='id', read_only=True)
+
+    class Meta:
+        model = PlanningJob
+        fields = ['job_id', 'trip', 'status', 'stage', 'progress', 'result', 'error',
+                  'created_at', 'updated_at', 'finished_at']
+
+
+def validate_coordinate(value):
+    try:
+        lon, lat = (float(part) for part in value.split(','))
+    except ValueError:
+        raise serializers.ValidationError('Must be "lon,lat" coordinates.') from None
+    if not (-180 <= lon <= 180 and -90 <= lat <= 90):
+        raise serializers.ValidationError('Coordinates are out of range.')
+
+
+class DispatchTruckSerializer(serializers.Serializer):
+    id = serializers.CharField(max_length=64)
+    location = serializers.CharField(validators=[validate_coordinate])
+    hours_available = serializers.FloatField(min_value=0, max_value=CYCLE_LIMIT_HOURS, required=False)
+    driver = serializers.IntegerField(required=False)
+
+    def to_internal_value(self, data):
+        attrs = super().to_internal_value(data)
+        if 'driver' not in attrs and 'hours_available' not in attrs:
+            raise serializers.ValidationError({'hours_available': ['Required without a driver.']})
+        return attrs
+
+
+class DispatchLoadSerializer(serializers.Serializer):
+    id = serializers.CharField(max_length=64)
+    pickup_location = serializers.CharField(validators=[validate_coordinate])
+    dropoff_location = serializers.CharField(validators=[validate_coordinate])
+
+
+class DispatchSerializer(serializers.Serializer):
+    trucks = DispatchTruckSerializer(many=True, allow_empty=False)
+    loads = DispatchLoadSerializer(many=True, allow_empty=False)
+
+    def validate(self, attrs):
+        if len(attrs['trucks']) > settings.DISPATCH_MAX_TRUCKS:
+            raise serializers.ValidationError({'trucks': [f'At most {settings.DISPATCH_MAX_TRUCKS} trucks.']})
+        if len(attrs['loads']) > settings.DISPATCH_MAX_LOADS:
+            raise serializers.ValidationError({'loads': [f'At most {settings.DISPATCH_MAX_LOADS} loads.']})
+
+        # Trucks with a driver take their hours from the ledger, all drivers in one query
+        driver_ids = {truck['driver'] for truck in attrs['trucks'] if 'driver' in truck}
+        drivers = Driver.objects.in_bulk(driver_ids) if driver_ids else {}
+        unknown = sorted(driver_ids - set(drivers))
+        if unknown:
+            raise serializers.ValidationError({'trucks': [f'Unknown drivers: {unknown}']})
+        for truck in attrs['trucks']:
+            if 'driver' in truck:
+                truck['hours_available'] = availability(drivers[truck['driver']])['hours_available']
+        return attrs
@@ -1,73 +1,143 @@
+import asyncio
 import requests
 import logging
 import math
-from haversine import haversine
+from concurrent.futures import ThreadPoolExecutor, wait
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from functools import lru_cache
+from django.db import DatabaseError
 from .models import DriverLog as Log
+from .geometry import RouteIndex
+from .caching import LookupCache, normalize_coordinate, normalize_place
+from .mapbox import MapboxClient
+from .metrics import submit_with_context, timed
+from .poi_index import get_poi_index
 
 logger = logging.getLogger("django")
 
-MAPBOX_API_KEY = settings.MAPBOX_API_KEY
+mapbox = MapboxClient.from_settings()
+POI_LOOKUP_WORKERS = settings.POI_LOOKUP_WORKERS
+POI_LOOKUP_TIMEOUT = settings.POI_LOOKUP_TIMEOUT
 
-def get_route_details(start, pickup, end):
-    """Fetches route details from Mapbox Directions API with error handling."""
-        
-    url = f"https://api.mapbox.com/directions/v5/mapbox/driving/{start};{pickup};{end}"
+geocode_cache = LookupCache("geocode", settings.GEOCODE_CACHE_TTL, settings.GEOCODE_CACHE_MAX_ENTRIES)
+reverse_geocode_cache = LookupCache("reverse_geocode", settings.GEOCODE_CACHE_TTL, settings.GEOCODE_CACHE_MAX_ENTRIES)
+route_cache = LookupCache("route", settings.ROUTE_CACHE_TTL, settings.ROUTE_CACHE_MAX_ENTRIES)
+
+def get_route_details(start, pickup, end, refresh=False):
+    """
+    Fetches route details from Mapbox Directions API with error handling.
+
+    Routes are cached per lane, keyed on the start/pickup/end coordinates
+    rounded to ROUTE_CACHE_PRECISION decimals. Pass ``refresh=True`` to skip
+    the cache and re-plan the lane.
+    """
+    return route_cache.get_or_fetch(_lane_key(start, pickup, end),
+                                    lambda: _fetch_route(start, pickup, end), refresh=refresh)
+
+
+async def aget_route_details(start, pickup, end, refresh=False):
+    """Async version of get_route_details."""
+    return await route_cache.aget_or_fetch(_lane_key(start, pickup, end),
+                                           lambda: _afetch_route(start, pickup, end), refresh=refresh)
+
+
+# Bump when the shape of cached routes changes so old entries are never read
+ROUTE_CACHE_VERSION = 2
+
+
+def _lane_key(*points):
+    return f"v{ROUTE_CACHE_VERSION}|" + "|".join(normalize_coordinate(point, settings.ROUTE_CACHE_PRECISION)
+                                                for point in points)
+
+
+def _route_request(*points):
+    path = f"/directions/v5/mapbox/driving/{';'.join(points)}"
     params = {
-        "access_token": MAPBOX_API_KEY,
         "geometries": "geojson",
         "steps": "true",
         "overview": "full"
     }
+    return "directions", path, params
+
 
+def _parse_route(data):
+    if "routes" in data and data["routes"]:
+        route = data["routes"][0]
+        # Only keep what the planner reads, so cached and fresh routes look the same.
+        # Steps shrink to [distance (m), duration (s)] pairs for stop placement.
+        return {
+            "routes": [{
+                "distance": route["distance"],
+                "duration": route["duration"],
+                "geometry": route["geometry"],
+                "legs": [
+                    {"steps": [[step["distance"], step["duration"]] for step in leg.get("steps") or []]
+                     or [[leg["distance"], leg["duration"]]]}
+                    for leg in route.get("legs") or []
+                ],
+            }]
+        }
+    logger.error("Mapbox API returned no routes.")
+    return None
+
+
+def _fetch_route(start, pickup, end):
     try:
-        response = requests.get(url, params=params)
-        response.raise_for_status()
-        data = response.json()
+        return _parse_route(mapbox.get(*_route_request(start, pickup, end)))
+    except requests.RequestException as e:
+        logger.error(f"Mapbox API Error: {e}")
+        return None
 
-        if "routes" in data and data["routes"]:
-            return data
-        else:
-            logger.error("Mapbox API returned no routes.")
-            return None
+
+async def _afetch_route(start, pickup, end):
+    try:
+        return _parse_route(await mapbox.aget(*_route_request(start, pickup, end)))
     except requests.RequestException as e:
         logger.error(f"Mapbox API Error: {e}")
         return None
 
-@lru_cache(maxsize=100)  # Cache responses to reduce API calls
+
 def reverse_geocode(coordinate):
     """Converts latitude,longitude into a human-readable address."""
-    url = f"https://api.mapbox.com/geocoding/v5/mapbox.places/{coordinate}.json"
-    params = {"access_token": MAPBOX_API_KEY}
+    query = normalize_coordinate(coordinate, settings.GEOCODE_CACHE_PRECISION)
+    place_name = reverse_geocode_cache.get_or_fetch(query, lambda: _fetch_place_name(query))
+    return place_name or "Unknown Location"
 
-    try:
-        response = requests.get(url, params=params)
-        response.raise_for_status()
-        data = response.json()
 
-        if "features" in data and data["features"]:
-            return data["features"][0]["place_name"]
-        else:
-            return "Unknown Location"
+def _parse_place_name(data):
+    if "features" in data and data["features"]:
+        return data["features"][0]["place_name"]
+    return None
+
+
+def _fetch_place_name(coordinate):
+    try:
+        return _parse_place_name(mapbox.get("geocoding", f"/geocoding/v5/mapbox.places/{coordinate}.json"))
     except requests.RequestException as e:
         logger.error(f"Reverse geocoding failed: {e}")
-        return "Unknown Location"
+        return None
 
 
 def geocode_location(location):
     """Converts a location name into latitude/longitude coordinates using Mapbox."""
-    url = f"https://api.mapbox.com/geocoding/v5/mapbox.places/{location}.json"
-    params = {"access_token": MAPBOX_API_KEY, "limit": 1}
+    query = normalize_place(location)
+    return geocode_cache.get_or_fetch(query, lambda: _fetch_coordinates(query))
+
+
+def _geocode_request(location):
+    return "geocoding", f"/geocoding/v5/mapbox.places/{location}.json", {"limit": 1}
+
+
+def _parse_coordinates(data):
+    if "features" in data and data["features"]:
+        coords = data["features"][0]["center"]
+        return f"{coords[0]},{coords[1]}"
+    return None
 
-    try:
-        response = requests.get(url, params=params)
-        response.raise_for_status()
-        data = response.json()
 
-        if "features" in data and data["features"]:
-            coords = data["features"][0]["center"]
-            return f"{coords[0]},{coords[1]}"
+def _fetch_coordinates(location):
+    try:
+        return _parse_coordinates(mapbox.get(*_geocode_request(location)))
     except requests.RequestException as e:
         logger.error(f"Geocoding Error: {e}")
         return None
@@ -90,64 +160,240 @@ def calculate_trip_details(route_data, cycle_hours_used):
         logger.error(f"Missing key in route data: {e}")
         return None, None, None
 
+METERS_PER_MILE = 1609.34
 FUEL_LIMIT_MILES = 1000  # Refueling every 1,000 miles
 REST_BREAK_INTERVAL = 8  # 30-min break required after 8 hours
 
-def calculate_stops(total_miles, total_hours, route_geometry):
-    """Determines fuel and rest stops along the route."""
-    try:
-        fuel_stops = math.floor(total_miles / FUEL_LIMIT_MILES)
-        rest_stops = math.ceil(total_hours / REST_BREAK_INTERVAL)
-
-        fuel_locations = []
-        for i in range(1, fuel_stops + 1):
-            fraction = i / (fuel_stops + 1)
-            coord = calculate_interval_point(route_geometry, fraction)
-            fuel_locations.append(find_nearest_poi(coord, 'gas_station'))
+def calculate_stops(total_miles, total_hours, route_geometry, legs=None):
+    """
+    Determines fuel and rest stops along the route.
 
-        rest_locations = []
-        for i in range(1, rest_stops + 1):
-            fraction = i / (rest_stops + 1)
-            coord = calculate_interval_point(route_geometry, fraction)
-            logger.info(f"Rest stop coordinates: {coord}")            
-            rest_locations.append(find_nearest_poi(coord, 'hotel'))
+    Fuel stops go where the distance driven reaches each FUEL_LIMIT_MILES and
+    rest stops where the driving time reaches each REST_BREAK_INTERVAL, read
+    from the route's step durations (``legs`` as kept by _parse_route). Without
+    steps the route is treated as one step driven at an even pace.
+    """
+    try:
+        fuel_stops, rest_stops, lookups, mile_markers, index = _plan_stop_lookups(
+            total_miles, total_hours, route_geometry, legs)
+        with timed("poi_index"):
+            locations = _find_local_pois(index, lookups, mile_markers)
+        missing = [i for i, location in enumerate(locations) if location is None]
+        with timed("poi_search"):
+            found = find_nearest_pois([lookups[i] for i in missing])
+        for i, location in zip(missing, found):
+            locations[i] = location
+        return _split_stop_locations(fuel_stops, rest_stops, locations, mile_markers)
+    except Exception as e:
+        logger.error(f"Error calculating stops: {e}")
+        return 0, 0, [], []
 
-        logger.info(f"Fuel locations: {fuel_locations}, Rest locations: {rest_locations}")
 
-        return fuel_stops, rest_stops, fuel_locations, rest_locations
+async def acalculate_stops(total_miles, total_hours, route_geometry, legs=None):
+    """Async version of calculate_stops."""
+    try:
+        fuel_stops, rest_stops, lookups, mile_markers, index = _plan_stop_lookups(
+            total_miles, total_hours, route_geometry, legs)
+        with timed("poi_index"):
+            locations = await sync_to_async(_find_local_pois)(index, lookups, mile_markers)
+        missing = [i for i, location in enumerate(locations) if location is None]
+        with timed("poi_search"):
+            found = await afind_nearest_pois([lookups[i] for i in missing])
+        for i, location in zip(missing, found):
+            locations[i] = location
+        return _split_stop_locations(fuel_stops, rest_stops, locations, mile_markers)
     except Exception as e:
         logger.error(f"Error calculating stops: {e}")
         return 0, 0, [], []
 
 
-def find_nearest_poi(coordinate, poi_type):
-    """Find actual POIs using Mapbox Search API"""
-    url = f"https://api.mapbox.com/search/v1/category/{poi_type}"
+def _plan_stop_lookups(total_miles, total_hours, route_geometry, legs=None):
+    index = RouteIndex.from_geometry(route_geometry)
+    if not legs:
+        legs = [{"steps": [[total_miles * METERS_PER_MILE, total_hours * 3600]]}]
+    fuel_miles, rest_miles, route_miles = _stop_miles(legs)
+
+    # Step distances are road miles; scale them onto the geometry the stops are placed on
+    scale = index.total_miles / route_miles if route_miles else 0.0
+    mile_markers = [mile * scale for mile in fuel_miles + rest_miles]
+    coords = index.points_at_miles(mile_markers)
+    fuel_coords, rest_coords = coords[:len(fuel_miles)], coords[len(fuel_miles):]
+    logger.info(f"Rest stop coordinates: {rest_coords}")
+
+    lookups = [(coord, 'gas_station') for coord in fuel_coords]
+    lookups += [(coord, 'hotel') for coord in rest_coords]
+    return len(fuel_miles), len(rest_miles), lookups, mile_markers, index
+
+
+def _stop_miles(legs):
+    """
+    One pass over the route's steps, collecting where stops are due.
+
+    Returns:
+        tuple: (miles where the distance driven reaches each FUEL_LIMIT_MILES,
+        miles where the driving time reaches each REST_BREAK_INTERVAL hours,
+        total miles), assuming an even pace within each step
+    """
+    fuel_miles, rest_miles = [], []
+    next_fuel, next_rest = FUEL_LIMIT_MILES, REST_BREAK_INTERVAL
+    miles = hours = 0.0
+    for leg in legs:
+        for distance, duration in leg["steps"]:
+            step_miles, step_hours = distance / METERS_PER_MILE, duration / 3600
+            while next_fuel < miles + step_miles:
+                fuel_miles.append(next_fuel)
+                next_fuel += FUEL_LIMIT_MILES
+            while next_rest < hours + step_hours:
+                rest_miles.append(miles + step_miles * (next_rest - hours) / step_hours)
+                next_rest += REST_BREAK_INTERVAL
+            miles += step_miles
+            hours += step_hours
+    return fuel_miles, rest_miles, miles
+
+
+def _find_local_pois(route_index, lookups, mile_markers):
+    """
+    Looks stops up in the offline POI index first.
+
+    Returns one POI per lookup, or None where the index has nothing within
+    POI_CORRIDOR_MILES of the route near that stop (those fall back to Mapbox).
+    """
+    try:
+        poi_index = get_poi_index()
+    except DatabaseError as e:
+        logger.error(f"Offline POI index unavailable: {e}")
+        return [None] * len(lookups)
+
+    return [
+        poi_index.best_along_route(route_index, mile, poi_type,
+                                   settings.POI_CORRIDOR_MILES, settings.POI_SEARCH_WINDOW_MILES)
+        for (_, poi_type), mile in zip(lookups, mile_markers)
+    ]
+
+
+def _split_stop_locations(fuel_stops, rest_stops, locations, mile_markers):
+    locations = [
+        {**(location if isinstance(location, dict) else
+            {"name": location, "icon": "marker", "coords": None}),
+         "mile_marker": round(mile, 2)}
+        for location, mile in zip(locations, mile_markers)
+    ]
+    fuel_locations = locations[:fuel_stops]
+    rest_locations = locations[fuel_stops:]
+    logger.info(f"Fuel locations: {fuel_locations}, Rest locations: {rest_locations}")
+    return fuel_stops, rest_stops, fuel_locations, rest_locations
+
+
+def _poi_request(coordinate, poi_type):
+    path = f"/search/v1/category/{poi_type}"
     params = {
-        'access_token': MAPBOX_API_KEY,
         'limit': 1,
         'proximity': f"{coordinate[0]},{coordinate[1]}",
         'language': 'en',
     }
+    return "search", path, params
+
+
+def _parse_poi(results):
+    logger.info(f"POI search results: {results}")
+    if results['features']:
+        feature = results['features'][0]
+        return {
+            "name": feature['properties'].get('place_name', 'Unknown'),
+            "icon": feature['properties'].get('maki', 'marker'),
+            "coords": feature['geometry']['coordinates']
+        }
+    return {"name": "Unknown", "icon": "marker", "coords": None}
+
+
+def find_nearest_poi(coordinate, poi_type, timeout=None):
+    """Find actual POIs using Mapbox Search API"""
+    try:
+        return _parse_poi(mapbox.get(*_poi_request(coordinate, poi_type), timeout=timeout))
+    except Exception as e:
+        logger.error(f"POI search failed: {e}")
+        return "Unknown Location"
+
 
+async def afind_nearest_poi(coordinate, poi_type, timeout=None):
+    """Async version of find_nearest_poi."""
     try:
-        response = requests.get(url, params=params)
-        response.raise_for_status()
-
-        results = response.json()
-        logger.info(f"POI search results: {results}")
-        if results['features']:
-            feature = results['features'][0]
-            return {
-                "name": feature['properties'].get('place_name', 'Unknown'),
-                "icon": feature['properties'].get('maki', 'marker'),
-                "coords": feature['geometry']['coordinates']
-            }
-        return {"name": "Unknown", "icon": "marker", "coords": None}
+        return _parse_poi(await mapbox.aget(*_poi_request(coordinate, poi_type), timeout=timeout))
     except Exception as e:
         logger.error(f"POI search failed: {e}")
         return "Unknown Location"
 
+
+def find_nearest_pois(lookups):
+    """
+    Run find_nearest_poi for many stops at once on a bounded thread pool.
+
+    Args:
+        lookups (list): (coordinate, poi_type) pairs
+
+    Returns:
+        list: one POI per lookup, in the same order as ``lookups``. A lookup
+        that fails or is still running when the stage deadline passes gets an
+        "Unknown" POI instead of failing the others.
+    """
+    if not lookups:
+        return []
+
+    workers = max(1, min(POI_LOOKUP_WORKERS, len(lookups)))
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="poi-lookup")
+    try:
+        futures = [
+            submit_with_context(executor, find_nearest_poi, coord, poi_type, POI_LOOKUP_TIMEOUT)
+            for coord, poi_type in lookups
+        ]
+        done, _ = wait(futures, timeout=_poi_stage_deadline(len(lookups), workers))
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return _collect_pois(lookups, futures, done)
+
+
+async def afind_nearest_pois(lookups):
+    """Async version of find_nearest_pois, bounded by a semaphore instead of a pool."""
+    if not lookups:
+        return []
+
+    workers = max(1, min(POI_LOOKUP_WORKERS, len(lookups)))
+    semaphore = asyncio.Semaphore(workers)
+
+    async def lookup(coord, poi_type):
+        async with semaphore:
+            return await afind_nearest_poi(coord, poi_type, POI_LOOKUP_TIMEOUT)
+
+    tasks = [asyncio.ensure_future(lookup(coord, poi_type)) for coord, poi_type in lookups]
+    done, pending = await asyncio.wait(tasks, timeout=_poi_stage_deadline(len(lookups), workers))
+    for task in pending:
+        task.cancel()
+
+    return _collect_pois(lookups, tasks, done)
+
+
+def _poi_stage_deadline(lookup_count, workers):
+    # A lookup takes at most one Mapbox call budget (connect and read timeouts of
+    # every attempt plus the backoffs between them), so the stage needs at most
+    # one budget per wave of workers.
+    return mapbox.call_budget("search", POI_LOOKUP_TIMEOUT) * math.ceil(lookup_count / workers)
+
+
+def _collect_pois(lookups, futures, done):
+    results = []
+    for future, (coord, poi_type) in zip(futures, lookups):
+        if future not in done:
+            logger.error(f"POI search for {poi_type} near {coord} timed out")
+            results.append({"name": "Unknown", "icon": "marker", "coords": None})
+        elif future.exception() is not None:
+            logger.error(f"POI search for {poi_type} near {coord} failed: {future.exception()}")
+            results.append({"name": "Unknown", "icon": "marker", "coords": None})
+        else:
+            results.append(future.result())
+    return results
+
+
 def calculate_interval_point(route_geometry, fraction):
     """
     Calculate a point along the route at a specified fraction of total distance
@@ -167,60 +413,45 @@ def calculate_interval_point(route_geometry, fraction):
     if len(coords) < 2:
         return coords[0] if coords else None
 
-    # Calculate cumulative distances between all points
-    cumulative_distances = [0.0]
-    total_distance = 0.0
-    
-    for i in range(1, len(coords)):
-        prev = (coords[i-1][1], coords[i-1][0])  # (lat, lon)
-        curr = (coords[i][1], coords[i][0])
-        segment_dist = haversine(prev, curr, unit='mi')
-        total_distance += segment_dist
-        cumulative_distances.append(total_distance)
-
-    target_distance = total_distance * fraction
-
-    # Find the segment where target distance falls
-    for i in range(1, len(cumulative_distances)):
-        if cumulative_distances[i] >= target_distance:
-            # Found the segment between points i-1 and i
-            segment_start = i-1
-            segment_distance = cumulative_distances[i] - cumulative_distances[i-1]
-            remaining = target_distance - cumulative_distances[i-1]
-            fraction_along_segment = remaining / segment_distance if segment_distance > 0 else 0
-            
-            # Get start and end points of the segment
-            start_lon, start_lat = coords[segment_start]
-            end_lon, end_lat = coords[i]
-            
-            # Linear interpolation
-            lon = start_lon + fraction_along_segment * (end_lon - start_lon)
-            lat = start_lat + fraction_along_segment * (end_lat - start_lat)
-            return (lon, lat)
-
-    # If fraction >= 1.0, return last point
-    return coords[-1]
+    return RouteIndex(coords).point_at_fraction(fraction)
 
 
 # Updated compliance check
-def check_compliance(trip):
+def check_compliance(trip, logs=None):
+    """
+    Evaluates a trip's logs and stores the result in ``trip.violations``.
+
+    Pass the logs that were just built to skip re-reading them from the database;
+    call it inside the transaction that wrote them so both are saved together.
+    """
+    if logs is None:
+        logs = trip.logs.order_by('date')
+    trip.violations = compliance_violations(logs)
+    trip.save(update_fields=['violations', 'updated_at'])
+    return trip.violations
+
+
+def compliance_violations(logs):
+    """Returns the HOS violations found in a trip's logs."""
     violations = []
     consecutive_driving_days = 0
-    
-    for i, log in enumerate(trip.logs.order_by('date')):
-        # Sleeper berth validation
-        if log.sleeper_berth_hours > 0:
-            if not (7 <= log.sleeper_berth_hours <= 8 and 
+
+    for i, log in enumerate(sorted(logs, key=lambda log: log.date)):
+        # Sleeper berth validation (a 34-hour restart is not a split)
+        if 0 < log.sleeper_berth_hours < 34:
+            if not (7 <= log.sleeper_berth_hours <= 8 and
                    log.off_duty_hours >= 2):
                 violations.append(
                     f"Invalid sleeper berth split on {log.date}: "
                     f"Must be 7-8h sleeper + 2h off-duty"
                 )
-        
+
         # 34-hour restart check
         if i > 0 and log.sleeper_berth_hours >= 34:
             consecutive_driving_days = 0  # Reset cycle
-            
+
         consecutive_driving_days += 1
         if consecutive_driving_days > 8:
             violations.append("8-day driving limit exceeded")
+
+    return violations
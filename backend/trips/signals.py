@@ -0,0 +1,57 @@
+import threading
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .caching import invalidate_trips, touch_trips
+from .ledger import rebuild
+from .models import DriverLog, Trip
+
+# bulk_create/bulk_update/update() send no signals; code using them calls
+# touch_trips/invalidate_trips itself. The planner's bulk-created logs are
+# added to the ledger by ledger.record_duty, so they never cause a rebuild.
+
+_local = threading.local()
+
+
+@receiver([post_save, post_delete], sender=Trip)
+def trip_changed(sender, instance, **kwargs):
+    invalidate_trips([instance.id])
+
+
+@receiver([post_save, post_delete], sender=DriverLog)
+def log_changed(sender, instance, **kwargs):
+    # Deleting a trip sends one signal per log: each trip is touched once per
+    # transaction and each driver's ledger rebuilt once, after the commit
+    pending = _pending_rebuilds()
+    if instance.trip_id in pending.trips:
+        return
+    pending.trips.add(instance.trip_id)
+    touch_trips([instance.trip_id])
+    driver_id = Trip.objects.filter(id=instance.trip_id).values_list("driver_id", flat=True).first()
+    if driver_id:
+        pending.drivers.add(driver_id)
+    if not transaction.get_connection().in_atomic_block:
+        pending.run()
+
+
+class _PendingRebuilds:
+    def __init__(self):
+        self.trips = set()
+        self.drivers = set()
+
+    def run(self):
+        for driver_id in sorted(self.drivers):
+            rebuild(driver_id)
+
+
+def _pending_rebuilds():
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        return _PendingRebuilds()
+    pending = getattr(_local, "pending", None)
+    # Registered on_commit callbacks are dropped on commit and rollback, so a
+    # holder whose callback is gone belongs to a finished transaction
+    if pending is None or not any(callback == pending.run for _, callback, *_ in connection.run_on_commit):
+        pending = _local.pending = _PendingRebuilds()
+        transaction.on_commit(pending.run)
+    return pending
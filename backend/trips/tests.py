@@ -1,3 +1,470 @@
-from django.test import TestCase
+import asyncio
+import itertools
+import json
+import math
+import random
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from unittest import mock
+import httpx
+import requests
+from django.db import transaction
+from django.db.models import QuerySet
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from .caching import LookupCache
+from .dispatch import assign
+from .fake_mapbox import FakeMapbox
+from .geometry import decode_polyline, encode_polyline, simplify, tolerance_for_zoom
+from .mapbox import CircuitOpenError, InvalidResponseError, MapboxClient
+from .models import Driver, DriverLog, LookupCacheEntry, Trip
+from .pagination import encode_cursor
+from .planning import parse_geometry_options
+from .services import mapbox
+from . import ledger
 
-# Create your tests here.
+# A lane short enough to drive in one duty day, and one that needs several
+SHORT_TRIP = {"current_location": "-90,35", "pickup_location": "-89,35", "dropoff_location": "-88,35"}
+LONG_TRIP = {"current_location": "-100,35", "pickup_location": "-90,36", "dropoff_location": "-80,35"}
+
+
+class FakeMapboxTestCase(TestCase):
+    """Runs every Mapbox call of the test against a FakeMapbox."""
+
+    def setUp(self):
+        super().setUp()
+        self.fake = FakeMapbox(seed=1)
+        installed = self.fake.installed(mapbox)
+        installed.__enter__()
+        self.addCleanup(installed.__exit__, None, None, None)
+
+    def create_trip(self, **data):
+        response = self.client.post("/api/trip/", data=json.dumps(data), content_type="application/json")
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.json()
+
+
+class DriverLedgerTests(FakeMapboxTestCase):
+    def setUp(self):
+        super().setUp()
+        self.driver = Driver.objects.create(name="Test Driver")
+
+    def assert_days_do_not_overlap(self):
+        dates = list(DriverLog.objects.filter(trip__driver=self.driver).values_list("date", flat=True))
+        self.assertEqual(len(dates), len(set(dates)))
+
+    def test_next_trip_starts_after_planned_days(self):
+        first = self.create_trip(driver=self.driver.id, **SHORT_TRIP)
+        second = self.create_trip(driver=self.driver.id, **SHORT_TRIP)
+
+        self.assert_days_do_not_overlap()
+        first_day = date.fromisoformat(first["logs"][-1]["date"])
+        self.assertEqual(date.fromisoformat(second["logs"][0]["date"]), first_day + timedelta(days=1))
+        # The second trip counts the first one's on-duty hours
+        self.assertEqual(first["trip"]["cycle_hours"], 0)
+        on_duty = sum(log["on_duty_hours"] for log in first["logs"])
+        self.assertEqual(second["trip"]["cycle_hours"], math.ceil(on_duty))
+
+    def test_ledger_totals_per_day(self):
+        for _ in range(3):
+            self.create_trip(driver=self.driver.id, **LONG_TRIP)
+        self.assert_days_do_not_overlap()
+
+        self.driver.refresh_from_db()
+        for key, hours in self.driver.duty_hours.items():
+            self.assertLessEqual(hours, 14, key)
+        logs = DriverLog.objects.filter(trip__driver=self.driver)
+        self.assertEqual(sum(self.driver.duty_hours.values()), sum(log.on_duty_hours for log in logs))
+
+    def test_availability_counts_planned_days(self):
+        trip = self.create_trip(driver=self.driver.id, **SHORT_TRIP)
+        available = ledger.availability(Driver.objects.get(id=self.driver.id))
+
+        last_day = date.fromisoformat(trip["logs"][-1]["date"])
+        self.assertEqual(available["available_from"], last_day + timedelta(days=1))
+        self.assertAlmostEqual(available["cycle_hours_used"], round(trip["logs"][0]["on_duty_hours"], 2))
+
+    def test_rebuild_matches_incremental_ledger(self):
+        for _ in range(2):
+            self.create_trip(driver=self.driver.id, **SHORT_TRIP)
+        self.driver.refresh_from_db()
+        incremental = (self.driver.duty_hours, self.driver.cycle_hours)
+
+        rebuilt = ledger.rebuild(self.driver.id)
+        self.assertEqual((rebuilt.duty_hours, rebuilt.cycle_hours), incremental)
+
+    def test_batch_schedules_a_drivers_trips_one_after_another(self):
+        specs = [{"driver": self.driver.id, **SHORT_TRIP}] * 3
+        response = self.client.post("/api/trips/batch/", data=json.dumps(specs), content_type="application/json")
+
+        self.assertEqual(response.status_code, 200, response.content)
+        results = response.json()["results"]
+        self.assertEqual([result["status"] for result in results], ["created"] * 3)
+        self.assert_days_do_not_overlap()
+        self.assertEqual([result["trip"]["cycle_hours"] for result in results],
+                         sorted(result["trip"]["cycle_hours"] for result in results))
+        self.assertGreater(results[2]["trip"]["cycle_hours"], 0)
+
+    def test_deleting_a_trip_rebuilds_the_ledger_once(self):
+        first = self.create_trip(driver=self.driver.id, **LONG_TRIP)
+        self.create_trip(driver=self.driver.id, **SHORT_TRIP)
+        self.assertGreater(len(first["logs"]), 1)
+
+        with mock.patch("trips.signals.rebuild", wraps=ledger.rebuild) as rebuild:
+            with self.captureOnCommitCallbacks(execute=True):
+                Trip.objects.get(id=first["trip"]["id"]).delete()
+        rebuild.assert_called_once_with(self.driver.id)
+
+        self.driver.refresh_from_db()
+        logs = DriverLog.objects.filter(trip__driver=self.driver)
+        self.assertEqual(sum(self.driver.duty_hours.values()), sum(log.on_duty_hours for log in logs))
+
+    def test_editing_a_log_rebuilds_the_ledger_after_commit(self):
+        trip = self.create_trip(driver=self.driver.id, **SHORT_TRIP)
+        log = DriverLog.objects.get(id=trip["logs"][0]["id"])
+
+        with mock.patch("trips.signals.rebuild") as rebuild:
+            with self.captureOnCommitCallbacks(execute=False) as callbacks:
+                log.on_duty_hours = 1
+                log.save()
+                log.save()
+            rebuild.assert_not_called()
+            for callback in callbacks:
+                callback()
+        rebuild.assert_called_once_with(self.driver.id)
+
+
+class KeysetPaginationTests(TestCase):
+    def walk(self, url, page_size):
+        seen, cursor = [], None
+        while True:
+            response = self.client.get(url, {"page_size": page_size, **({"cursor": cursor} if cursor else {})})
+            self.assertEqual(response.status_code, 200, response.content)
+            body = response.json()
+            seen += [row["id"] for row in body["results"]]
+            cursor = body["next_cursor"]
+            if cursor is None:
+                return seen
+
+    def test_walks_every_trip_sharing_one_timestamp(self):
+        Trip.objects.bulk_create([Trip(cycle_hours=0, **SHORT_TRIP) for _ in range(50)])
+        Trip.objects.update(created_at=datetime(2026, 1, 2, 3, 4, 5, 678901, tzinfo=dt_timezone.utc))
+
+        seen = self.walk("/api/trips/", 7)
+        self.assertEqual(seen, list(Trip.objects.order_by("-id").values_list("id", flat=True)))
+
+    def test_walks_logs_in_date_order(self):
+        trip = Trip.objects.create(cycle_hours=0, **SHORT_TRIP)
+        DriverLog.objects.bulk_create([
+            DriverLog(trip=trip, date=date(2026, 1, 1 + i % 3), driving_hours=1, on_duty_hours=1,
+                      off_duty_hours=23, sleeper_berth_hours=0)
+            for i in range(20)
+        ])
+
+        seen = self.walk("/api/logs/", 6)
+        self.assertEqual(seen, list(DriverLog.objects.order_by("date", "id").values_list("id", flat=True)))
+
+    def test_malformed_cursors_are_rejected(self):
+        Trip.objects.create(cycle_hours=0, **SHORT_TRIP)
+        for values in (["notadate", 1], [{"a": 1}, 1], ["2026-01-01T00:00:00Z", "x"], [None, 1], [1]):
+            with self.subTest(values=values):
+                response = self.client.get("/api/trips/", {"cursor": encode_cursor(values)})
+                self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get("/api/trips/", {"cursor": "not base64!"}).status_code, 400)
+
+
+class LookupCacheTests(TestCase):
+    def setUp(self):
+        self.cache = LookupCache("test", ttl=60, max_entries=100)
+
+    def entry(self, query):
+        return LookupCacheEntry.objects.get(key=self.cache._digest(query))
+
+    def test_get_or_fetch_fetches_once(self):
+        fetch = mock.Mock(return_value="value")
+        self.assertEqual(self.cache.get_or_fetch("q", fetch), "value")
+        self.assertEqual(self.cache.get_or_fetch("q", fetch), "value")
+        fetch.assert_called_once()
+
+    def test_none_is_not_cached(self):
+        fetch = mock.Mock(return_value=None)
+        self.cache.get_or_fetch("q", fetch)
+        self.cache.get_or_fetch("q", fetch)
+        self.assertEqual(fetch.call_count, 2)
+
+    @override_settings(LOOKUP_CACHE_HIT_FLUSH=3600)
+    def test_hits_are_written_in_batches(self):
+        self.cache.set("q", "value")
+        self.cache.flush_hits()
+        with self.assertNumQueries(3):
+            for _ in range(3):
+                self.assertEqual(self.cache.get("q"), "value")
+        self.assertEqual(self.entry("q").hits, 0)
+
+        self.assertEqual(self.cache.stats(), {"hits": 3, "misses": 1, "hit_rate": 0.75})
+
+    def test_expired_entries_miss(self):
+        self.cache.set("q", "value")
+        LookupCacheEntry.objects.update(fetched_at=timezone.now() - timedelta(seconds=61))
+        self.assertIsNone(self.cache.get("q"))
+
+    def test_get_many_keeps_order(self):
+        self.cache.set_many([("a", 1), ("c", 3)])
+        self.assertEqual(self.cache.get_many(["a", "b", "c"]), [1, None, 3])
+
+    def test_lost_insert_race_keeps_the_transaction_usable(self):
+        self.cache.set("q", "first")
+        with transaction.atomic():
+            # As if another worker inserted the entry between our update and create
+            with mock.patch.object(QuerySet, "update", return_value=0):
+                self.cache.set("q", "second")
+            self.assertEqual(LookupCacheEntry.objects.count(), 1)
+
+    def test_evicts_least_recently_used(self):
+        cache = LookupCache("small", ttl=60, max_entries=2)
+        for query in ("a", "b", "c"):
+            cache.set(query, query)
+        self.assertLessEqual(LookupCacheEntry.objects.filter(namespace="small").count(), 2)
+        self.assertEqual(cache.get("c"), "c")
+
+
+class TripPlanningTests(FakeMapboxTestCase):
+    def test_plans_a_trip(self):
+        body = self.create_trip(cycle_hours=0, **LONG_TRIP)
+
+        self.assertEqual(self.fake.calls["directions"], 1)
+        self.assertEqual(body["route_geometry"]["type"], "LineString")
+        self.assertGreaterEqual(body["stops"]["fuel_stops"], 1)
+        self.assertEqual(body["stops"]["fuel_stops"], len(body["stops"]["fuel_stop_locations"]))
+        self.assertGreater(len(body["logs"]), 1)
+        driving_hours = float(body["route_info"]["duration"].split()[0])
+        self.assertLessEqual(sum(log["driving_hours"] for log in body["logs"]), driving_hours + 0.01)
+        for log in body["logs"]:
+            self.assertLessEqual(log["driving_hours"], 11)
+            self.assertLessEqual(log["on_duty_hours"], 14)
+
+    def test_plans_a_multi_stop_trip(self):
+        direct = self.create_trip(cycle_hours=0, **SHORT_TRIP)
+        detour = self.create_trip(cycle_hours=0, waypoints=["-88.5,36"], **SHORT_TRIP)
+
+        self.assertEqual(self.fake.calls["directions"], 2)
+        miles = [float(body["route_info"]["distance"].split()[0]) for body in (direct, detour)]
+        self.assertGreater(miles[1], miles[0])
+
+    def test_polyline_geometry_decodes_to_the_route(self):
+        body = self.create_trip(cycle_hours=0, **SHORT_TRIP)
+        trip_id = body["trip"]["id"]
+        response = self.client.get(f"/api/trips/{trip_id}/", {"geometry": "polyline", "tolerance": "0"})
+
+        self.assertEqual(response.status_code, 200, response.content)
+        geometry = response.json()["route_geometry"]
+        points = decode_polyline(geometry["polyline"], geometry["precision"])
+        self.assertEqual(points[0], [-90, 35])
+        self.assertEqual(points[-1], [-88, 35])
+
+    def test_same_trip_reuses_the_cached_route(self):
+        self.create_trip(cycle_hours=0, **SHORT_TRIP)
+        self.create_trip(cycle_hours=5, **SHORT_TRIP)
+        self.assertEqual(self.fake.calls["directions"], 1)
+
+    def test_no_route_is_a_bad_gateway(self):
+        with FakeMapbox(fixtures={"directions": {"code": "NoRoute", "routes": []}}).installed(mapbox):
+            response = self.client.post("/api/trip/", data=json.dumps({"cycle_hours": 0, **SHORT_TRIP}),
+                                        content_type="application/json")
+        self.assertEqual(response.status_code, 502, response.content)
+
+    def test_rejects_bad_geometry_options(self):
+        for query in ("geometry=svg", "zoom=abc", "zoom=nan", "zoom=99", "tolerance=-1", "tolerance=inf"):
+            response = self.client.post(f"/api/trip/?{query}", data=json.dumps({"cycle_hours": 0, **SHORT_TRIP}),
+                                        content_type="application/json")
+            self.assertEqual(response.status_code, 400, query)
+        self.assertEqual(self.fake.calls, {})
+
+
+class GeometryTests(SimpleTestCase):
+    def line(self, count=500):
+        rng = random.Random(1)
+        return [[-100 + i * 0.01, 35 + 0.2 * math.sin(i / 20) + rng.uniform(-1e-4, 1e-4)] for i in range(count)]
+
+    def test_polyline_round_trip(self):
+        coordinates = self.line()
+        for precision in (5, 6):
+            decoded = decode_polyline(encode_polyline(coordinates, precision), precision)
+            self.assertEqual(len(decoded), len(coordinates))
+            for (lon, lat), (decoded_lon, decoded_lat) in zip(coordinates, decoded):
+                self.assertAlmostEqual(lon, decoded_lon, delta=10 ** -precision)
+                self.assertAlmostEqual(lat, decoded_lat, delta=10 ** -precision)
+
+    def test_polyline_matches_reference_encoding(self):
+        # The example from Google's polyline algorithm documentation, as (lon, lat)
+        coordinates = [[-120.2, 38.5], [-120.95, 40.7], [-126.453, 43.252]]
+        self.assertEqual(encode_polyline(coordinates), "_p~iF~ps|U_ulLnnqC_mqNvxq`@")
+        self.assertEqual(decode_polyline("_p~iF~ps|U_ulLnnqC_mqNvxq`@"), coordinates)
+
+    def test_simplify_keeps_points_within_tolerance(self):
+        coordinates = self.line()
+        simplified = simplify(coordinates, 200)
+
+        self.assertLess(len(simplified), len(coordinates) / 4)
+        self.assertEqual(simplified[0], coordinates[0])
+        self.assertEqual(simplified[-1], coordinates[-1])
+        # Every kept point is an original point, in order
+        kept = iter(map(tuple, coordinates))
+        self.assertTrue(all(tuple(point) in kept for point in simplified))
+
+    def test_simplify_without_tolerance_keeps_every_point(self):
+        coordinates = self.line(10)
+        self.assertEqual(simplify(coordinates, 0), coordinates)
+        self.assertEqual(simplify(coordinates[:2], 1000), coordinates[:2])
+
+    def test_simplify_drops_collinear_points(self):
+        self.assertEqual(simplify([[0, 0], [0.5, 0], [1, 0]], 1), [[0, 0], [1, 0]])
+
+    def test_tolerance_halves_with_each_zoom_level(self):
+        self.assertAlmostEqual(tolerance_for_zoom(10), 2 * tolerance_for_zoom(11))
+
+    def test_parse_geometry_options(self):
+        self.assertEqual(parse_geometry_options({"geometry": "POLYLINE", "tolerance": "5"}), ("polyline", 5.0))
+        # zoom wins over tolerance
+        self.assertEqual(parse_geometry_options({"zoom": "12", "tolerance": "5"}), ("geojson", tolerance_for_zoom(12)))
+        for params in ({"geometry": "svg"}, {"zoom": "x"}, {"zoom": "25"}, {"zoom": "nan"}, {"tolerance": "-1"},
+                       {"tolerance": "nan"}):
+            with self.assertRaises(ValueError, msg=params):
+                parse_geometry_options(params)
+
+
+class AssignmentTests(SimpleTestCase):
+    def brute_force(self, cost):
+        rows, cols = len(cost), len(cost[0])
+        if rows <= cols:
+            return min(sum(cost[row][col] for row, col in enumerate(perm))
+                       for perm in itertools.permutations(range(cols), rows))
+        return min(sum(cost[row][col] for col, row in enumerate(perm))
+                   for perm in itertools.permutations(range(rows), cols))
+
+    def test_matches_brute_force(self):
+        rng = random.Random(7)
+        for rows, cols in [(1, 1), (3, 3), (4, 6), (6, 4), (5, 5)]:
+            for _ in range(20):
+                cost = [[rng.randint(0, 50) for _ in range(cols)] for _ in range(rows)]
+                pairs = assign(cost)
+
+                self.assertEqual(len(pairs), min(rows, cols))
+                self.assertEqual(len({row for row, _ in pairs}), len(pairs))
+                self.assertEqual(len({col for _, col in pairs}), len(pairs))
+                self.assertEqual(sum(cost[row][col] for row, col in pairs), self.brute_force(cost), cost)
+
+    def test_returns_python_ints(self):
+        pairs = assign([[1, 2], [2, 1]])
+        self.assertEqual(sorted(pairs), [(0, 0), (1, 1)])
+        self.assertTrue(all(type(value) is int for pair in pairs for value in pair))
+
+    def test_empty(self):
+        self.assertEqual(assign([]), [])
+
+
+class MapboxClientTests(SimpleTestCase):
+    def setUp(self):
+        self.client = MapboxClient("token", {"directions": 1}, max_retries=2, retry_backoff=0,
+                                   breaker_threshold=2, breaker_cooldown=60)
+        self.fake = FakeMapbox(seed=1)
+        installed = self.fake.installed(self.client)
+        installed.__enter__()
+        self.addCleanup(installed.__exit__, None, None, None)
+
+    def respond(self, *responses):
+        return mock.patch.object(self.fake, "respond", side_effect=responses)
+
+    def expire_cooldown(self, endpoint="directions"):
+        self.client.breaker(endpoint).opened_at -= self.client.breaker_cooldown
+
+    def json_body(self, content):
+        response = requests.Response()
+        response.status_code = 200
+        response._content = content
+        return response
+
+    def test_retries_server_errors(self):
+        with self.respond((503, {}), (503, {}), (200, {"ok": True})) as respond:
+            self.assertEqual(self.client.get("directions", "/directions/x"), {"ok": True})
+        self.assertEqual(respond.call_count, 3)
+        self.assertEqual(self.client.latency_stats()["directions"]["errors"], 2)
+        self.assertEqual(self.client.breaker("directions").state, "closed")
+
+    def test_does_not_retry_client_errors(self):
+        with self.respond((404, {})) as respond, self.assertRaises(requests.HTTPError):
+            self.client.get("directions", "/directions/x")
+        self.assertEqual(respond.call_count, 1)
+        self.assertEqual(self.client.breaker("directions").failures, 0)
+
+    def test_opens_after_consecutive_failures_and_recovers(self):
+        with self.respond(*[(503, {})] * 6) as respond:
+            for _ in range(2):
+                with self.assertRaises(requests.HTTPError):
+                    self.client.get("directions", "/directions/x")
+            with self.assertRaises(CircuitOpenError):
+                self.client.get("directions", "/directions/x")
+        self.assertEqual(respond.call_count, 6)
+        self.assertEqual(self.client.breaker("directions").state, "open")
+
+        # Half-open: one trial call; its success closes the circuit
+        self.expire_cooldown()
+        with self.respond((200, {"ok": True})):
+            self.assertEqual(self.client.get("directions", "/directions/x"), {"ok": True})
+        self.assertEqual(self.client.breaker("directions").state, "closed")
+
+    def test_failed_trial_reopens_the_circuit(self):
+        breaker = self.client.breaker("directions")
+        for _ in range(2):
+            breaker.record_failure()
+        self.expire_cooldown()
+
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+
+    def test_invalid_json_counts_as_a_failure(self):
+        with mock.patch.object(self.client.session, "get", return_value=self.json_body(b"<html>")):
+            for _ in range(2):
+                with self.assertRaises(InvalidResponseError):
+                    self.client.get("directions", "/directions/x")
+        self.assertEqual(self.client.breaker("directions").state, "open")
+
+    def test_async_invalid_json_counts_as_a_failure(self):
+        self.client.async_transport = httpx.MockTransport(lambda request: httpx.Response(200, text="<html>"))
+
+        async def call():
+            with self.assertRaises(InvalidResponseError):
+                await self.client.aget("directions", "/directions/x")
+
+        for _ in range(2):
+            asyncio.run(call())
+        self.assertEqual(self.client.breaker("directions").state, "open")
+
+    def test_async_retries_server_errors(self):
+        with self.respond((503, {}), (200, {"ok": True})) as respond:
+            self.assertEqual(asyncio.run(self.client.aget("directions", "/directions/x")), {"ok": True})
+        self.assertEqual(respond.call_count, 2)
+
+    def test_cancelled_trial_frees_the_half_open_slot(self):
+        breaker = self.client.breaker("directions")
+        for _ in range(2):
+            breaker.record_failure()
+        self.expire_cooldown()
+
+        async def hang(request):
+            await asyncio.sleep(60)
+
+        self.client.async_transport = httpx.MockTransport(hang)
+
+        async def call():
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(self.client.aget("directions", "/directions/x"), 0.05)
+
+        asyncio.run(call())
+        self.assertTrue(breaker.allow())
+
+    def test_call_budget_covers_every_attempt(self):
+        client = MapboxClient("token", {"search": 5}, connect_timeout=3, max_retries=2, retry_cap=4)
+        self.assertEqual(client.call_budget("search"), (3 + 5) * 3 + 4 * 2)
+        self.assertEqual(client.call_budget("search", 1), (3 + 1) * 3 + 4 * 2)
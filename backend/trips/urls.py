@@ -1,10 +1,24 @@
+from django.conf import settings
 from django.urls import path
-from .views import create_trip, get_all_trips, get_trip_by_id
+from .views import (
+    create_trip, create_trip_async, create_trips_batch, get_all_trips, get_trip_by_id, get_planning_job,
+    get_logs, export_trips, export_logs, metrics_view, create_driver, get_driver,
+    dispatch_loads,
+)
 
 
 urlpatterns = [
-    path('api/trip/', create_trip, name="create-trip"),
+    path('api/trip/', create_trip_async if settings.ASYNC_TRIP_PLANNING else create_trip, name="create-trip"),
+    path('api/trips/batch/', create_trips_batch, name="create_trips_batch"),
     path('api/trips/', get_all_trips, name="get_all_trips"),
     path('api/trips/<int:trip_id>/', get_trip_by_id, name="get_trip_by_id"),
+    path('api/drivers/', create_driver, name="create_driver"),
+    path('api/drivers/<int:driver_id>/', get_driver, name="get_driver"),
+    path('api/dispatch/', dispatch_loads, name="dispatch_loads"),
+    path('api/logs/', get_logs, name="get_logs"),
+    path('api/export/trips/', export_trips, name="export_trips"),
+    path('api/export/logs/', export_logs, name="export_logs"),
+    path('api/jobs/<uuid:job_id>/', get_planning_job, name="get_planning_job"),
+    path('metrics', metrics_view, name="metrics"),
 
 ]
@@ -1,10 +1,33 @@
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
-from .models import DriverLog as Log, Trip
-from .serializers import TripSerializer, LogSerializer
-from .services import get_route_details, calculate_trip_details, calculate_stops, check_compliance
-from datetime import timedelta, date
+from rest_framework.views import APIView
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import connections
+from django.db.models import Prefetch, Q
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.crypto import constant_time_compare
+from django.utils.dateparse import parse_date
+from django.views.decorators.http import condition, require_GET
+from .models import Driver, DriverLog as Log, PlanningJob, Route, Trip
+from .serializers import (
+    DispatchSerializer, DriverSerializer, TripSerializer, TripWithLogsSerializer, LogSerializer,
+    PlanningJobSerializer,
+)
+from .pagination import keyset_page, parse_page_size
+from .caching import get_trip_payload, set_trip_payload, trip_version, version_tag
+from .planning import PlanningError, aplan_trip, parse_geometry_options, plan_trip, route_payload
+from .jobs import enqueue_planning
+from .batch import plan_batch
+from .dispatch import match_loads
+from .exports import EXPORT_FORMATS, LOG_EXPORT_FIELDS, TRIP_EXPORT_FIELDS, achunks, stream_rows
+from .services import mapbox
+from . import metrics
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+import inspect
 import logging
 
 logger = logging.getLogger("django")
@@ -12,124 +35,424 @@ logger = logging.getLogger("django")
 
 @api_view(['POST'])
 def create_trip(request):
+    try:
+        geometry_options = parse_geometry_options(request.query_params)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
     serializer = TripSerializer(data=request.data)
     if serializer.is_valid():
         trip = serializer.save()
+        refresh = _flag(request.query_params, "refresh")
 
-        route_data = get_route_details(trip.current_location, trip.pickup_location, trip.dropoff_location)
-        driving_hours, total_hours, total_miles = calculate_trip_details(
-            route_data, trip.cycle_hours
-        )
-
-        fuel_stops, rest_stops, fuel_locations, rest_locations = calculate_stops(
-            total_miles, total_hours, route_data["routes"][0]["geometry"])
-
-        log_entries = []
-        start_date = date.today()
-        remaining_driving = driving_hours
-        cycle_remaining = 70 - trip.cycle_hours
-        prev_day_ended_early = False
-
-        day = 0
-        while remaining_driving > 0 and day < 8:
-            # Calculate driving hours for the day
-            driving = min(11, remaining_driving, cycle_remaining)
-            on_duty = min(14, driving + 2)  # 2h for inspections/loading
-            
-            # Determine sleeper berth/off-duty split
-            if day == 0:
-                # First day doesn't need sleeper berth
-                sleeper_berth = 0
-                off_duty = 24 - on_duty
-            else:
-                # Use split sleeper berth if driving > 8 hours or previous day ended early
-                if driving > 8 or prev_day_ended_early:
-                    sleeper_berth = 8
-                    off_duty = 2
-                    prev_day_ended_early = False
-                else:
-                    sleeper_berth = 0
-                    off_duty = 24 - on_duty
-                    # If we finish early, mark for split next day
-                    if driving < 8 and remaining_driving - driving > 0:
-                        prev_day_ended_early = True
-
-            log_entry = Log.objects.create(
-                trip=trip,
-                date=start_date + timedelta(days=day),
-                driving_hours=driving,
-                on_duty_hours=on_duty,
-                off_duty_hours=off_duty,
-                sleeper_berth_hours=sleeper_berth
-            )
-            log_entries.append(log_entry)
-
-            remaining_driving -= driving
-            cycle_remaining -= driving
-            day += 1
-
-            # Check for 34-hour restart opportunity
-            if day >= 2 and sum(log.driving_hours for log in log_entries[-2:]) >= 20:
-                # Add 34-hour restart period
-                restart_entry = Log.objects.create(
-                    trip=trip,
-                    date=start_date + timedelta(days=day),
-                    driving_hours=0,
-                    on_duty_hours=0,
-                    off_duty_hours=10,
-                    sleeper_berth_hours=34
-                )
-                log_entries.append(restart_entry)
-                day += 2  # Skip next 2 days for restart
-                cycle_remaining = 70  # Reset cycle
-
-        check_compliance(trip)
-
-        return Response({
-            "trip": TripSerializer(trip).data,
-            "route_info": {
-                "distance": f"{total_miles:.2f} miles",
-                "duration": f"{total_hours:.2f} hours"
-            },
-            "stops": {
-                "fuel_stops": fuel_stops,
-                "rest_stops": rest_stops,
-                "fuel_stop_locations": fuel_locations,
-                "rest_stop_locations": rest_locations
-            },
-            "logs": LogSerializer(log_entries, many=True).data,
-            "route_geometry": route_data["routes"][0]["geometry"]
-        }, status=status.HTTP_201_CREATED)
+        if _flag(request.query_params, "async"):
+            job = enqueue_planning(trip, geometry_options, refresh=refresh)
+            return Response(_job_accepted(request, job), status=status.HTTP_202_ACCEPTED,
+                            headers={"Location": reverse("get_planning_job", args=[job.id])})
+
+        try:
+            payload = plan_trip(trip, geometry_options, refresh=refresh)
+        except PlanningError as e:
+            logger.error(f"Planning trip {trip.id} failed: {e}")
+            return Response({"error": str(e)}, status=status.HTTP_502_BAD_GATEWAY)
+        return Response(payload, status=status.HTTP_201_CREATED)
     logger.error("Trip serializer is invalid")
     logger.error(f"Errors: {serializer.errors}")
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+
+def _flag(params, name):
+    return params.get(name, "").lower() in ("1", "true", "yes")
+
+
+def _job_accepted(request, job):
+    return {
+        "job_id": str(job.id),
+        "trip_id": job.trip_id,
+        "status": job.status,
+        "status_url": request.build_absolute_uri(reverse("get_planning_job", args=[job.id])),
+    }
+
+
+@api_view(['POST'])
+def create_trips_batch(request):
+    """
+    Plan many trips in one request.
+
+    The body is a list of create_trip bodies (or ``{"trips": [...]}``), up to
+    BATCH_MAX_TRIPS. Shared addresses and lanes are looked up once and all
+    rows are bulk-inserted. Each item gets its own result, so one bad item
+    doesn't fail the batch. Accepts the same query params as create_trip.
+    """
+    try:
+        geometry_options = parse_geometry_options(request.query_params)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    specs = request.data.get("trips") if isinstance(request.data, dict) else request.data
+    if not isinstance(specs, list) or not specs:
+        return Response({"error": "Expected a non-empty list of trips"}, status=status.HTTP_400_BAD_REQUEST)
+    if len(specs) > settings.BATCH_MAX_TRIPS:
+        return Response({"error": f"A batch can hold at most {settings.BATCH_MAX_TRIPS} trips"},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    results = plan_batch(specs, geometry_options, refresh=_flag(request.query_params, "refresh"))
+    created = sum(result["status"] == "created" for result in results)
+    logger.info(f"Batch planned {created} of {len(results)} trips")
+    return Response({
+        "created": created,
+        "failed": len(results) - created,
+        "results": results,
+    }, status=status.HTTP_200_OK)
+
+
+class AsyncAPIView(APIView):
+    """
+    APIView whose handlers are coroutines.
+
+    DRF's dispatch is sync only. This one runs the same request setup
+    (parsing, authentication, permissions, throttling) through sync_to_async,
+    awaits the handler and finalizes the response as DRF does, so async views
+    behave like their @api_view twins.
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+            response = handler(request, *args, **kwargs)
+            if inspect.isawaitable(response):
+                response = await response
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+
+class CreateTripAsync(AsyncAPIView):
+    """
+    Async create_trip, served at the same URL when ASYNC_TRIP_PLANNING is on.
+
+    Directions and POI lookups await the async Mapbox client, so a single ASGI
+    worker keeps many plans in flight; ORM work runs through sync_to_async.
+    Requests and responses are the same as create_trip's.
+    """
+
+    async def post(self, request):
+        try:
+            geometry_options = parse_geometry_options(request.query_params)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        serializer = TripSerializer(data=request.data)
+        if not await sync_to_async(serializer.is_valid)():
+            logger.error("Trip serializer is invalid")
+            logger.error(f"Errors: {serializer.errors}")
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        trip = await sync_to_async(serializer.save)()
+        refresh = _flag(request.query_params, "refresh")
+
+        if _flag(request.query_params, "async"):
+            job = await sync_to_async(enqueue_planning)(trip, geometry_options, refresh=refresh)
+            return Response(_job_accepted(request, job), status=status.HTTP_202_ACCEPTED,
+                            headers={"Location": reverse("get_planning_job", args=[job.id])})
+
+        try:
+            payload = await aplan_trip(trip, geometry_options, refresh=refresh)
+        except PlanningError as e:
+            logger.error(f"Planning trip {trip.id} failed: {e}")
+            return Response({"error": str(e)}, status=status.HTTP_502_BAD_GATEWAY)
+        return Response(payload, status=status.HTTP_201_CREATED)
+
+
+create_trip_async = CreateTripAsync.as_view()
+
+
 @api_view(['GET'])
 def get_all_trips(request):
-    """Retrieve all trips with their logs."""
+    """
+    Retrieve trips, newest first, one keyset-paginated page at a time.
+
+    Query params: ``page_size``, ``cursor`` (the previous page's ``next_cursor``),
+    ``include_logs``, ``created_after``/``created_before`` (YYYY-MM-DD, inclusive)
+    and ``location`` (matches any of the trip's locations).
+    """
     logger.info("Fetching all trips")
+    params = request.query_params
+
+    try:
+        page_size = parse_page_size(params.get("page_size"), settings.TRIPS_PAGE_SIZE, settings.TRIPS_MAX_PAGE_SIZE)
+        trips = _filter_trips(Trip.objects.all(), params)
+        include_logs = params.get("include_logs", "").lower() in ("1", "true", "yes")
+        if include_logs:
+            trips = trips.prefetch_related(Prefetch("logs", queryset=Log.objects.order_by("date", "id")))
+        page, next_cursor = keyset_page(trips, ["created_at", "id"], params.get("cursor"), page_size)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    serializer_class = TripWithLogsSerializer if include_logs else TripSerializer
+    return Response({
+        "results": serializer_class(page, many=True).data,
+        "next_cursor": next_cursor,
+    }, status=status.HTTP_200_OK)
+
+
+def _filter_trips(trips, params):
+    for param, lookup, day_offset in (("created_after", "created_at__gte", 0),
+                                      ("created_before", "created_at__lt", 1)):
+        day = _date_param(params, param)
+        if day is not None:
+            start = datetime.combine(day + timedelta(days=day_offset), time.min, tzinfo=dt_timezone.utc)
+            trips = trips.filter(**{lookup: start})
+
+    location = params.get("location", "").strip()
+    if location:
+        trips = trips.filter(Q(current_location__icontains=location)
+                             | Q(pickup_location__icontains=location)
+                             | Q(dropoff_location__icontains=location))
+    return trips
+
+
+def _date_param(params, name):
+    if not params.get(name):
+        return None
+    day = parse_date(params[name])
+    if day is None:
+        raise ValueError(f"{name} must be a date (YYYY-MM-DD)")
+    return day
+
+
+@api_view(['GET'])
+def get_logs(request):
+    """
+    Retrieve driver logs across trips, oldest first, one keyset-paginated page at a time.
+
+    Query params: ``date_after``/``date_before`` (YYYY-MM-DD, inclusive),
+    ``trip`` (one or more comma-separated trip IDs), ``page_size`` and
+    ``cursor`` (the previous page's ``next_cursor``).
+    """
+    params = request.query_params
+    try:
+        page_size = parse_page_size(params.get("page_size"), settings.LOGS_PAGE_SIZE, settings.LOGS_MAX_PAGE_SIZE)
+        logs = _filter_logs(Log.objects.all(), params)
+        page, next_cursor = keyset_page(logs, ["date", "id"], params.get("cursor"), page_size, descending=False)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response({
+        "results": LogSerializer(page, many=True).data,
+        "next_cursor": next_cursor,
+    }, status=status.HTTP_200_OK)
+
+
+def _filter_logs(logs, params):
+    date_after, date_before = _date_param(params, "date_after"), _date_param(params, "date_before")
+    if date_after is not None:
+        logs = logs.filter(date__gte=date_after)
+    if date_before is not None:
+        logs = logs.filter(date__lte=date_before)
+    if params.get("trip"):
+        try:
+            trip_ids = [int(trip_id) for trip_id in params["trip"].split(",")]
+        except ValueError:
+            raise ValueError("trip must be a comma-separated list of trip IDs") from None
+        logs = logs.filter(trip_id__in=trip_ids)
+    return logs
+
+
+@require_GET
+def export_trips(request):
+    """
+    Stream every trip matching the get_all_trips filters as CSV or NDJSON (``?format=``).
+
+    Plain Django view: DRF would treat ``format`` as a renderer override.
+    """
+    return _export(request, "trips", lambda params: _filter_trips(Trip.objects.order_by("id"), params),
+                   TRIP_EXPORT_FIELDS)
+
+
+@require_GET
+def export_logs(request):
+    """Stream every driver log matching the get_logs filters as CSV or NDJSON (``?format=``)."""
+    return _export(request, "driver-logs",
+                   lambda params: _filter_logs(Log.objects.order_by("date", "id"), params), LOG_EXPORT_FIELDS)
+
+
+def _export(request, name, queryset_for, fields):
+    export_format = request.GET.get("format", "csv").lower()
+    if export_format not in EXPORT_FORMATS:
+        return JsonResponse({"error": f"format must be one of: {', '.join(EXPORT_FORMATS)}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+    try:
+        queryset = queryset_for(request.GET)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    logger.info(f"Exporting {name} as {export_format}")
+    chunks = stream_rows(queryset, fields, export_format)
+    if isinstance(request, ASGIRequest):
+        chunks = achunks(chunks)
+    response = StreamingHttpResponse(chunks, content_type=EXPORT_FORMATS[export_format])
+    filename = f"{name}-{datetime.now(dt_timezone.utc):%Y%m%d}.{export_format}"
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
+
 
-    trips = Trip.objects.all()
-    serialized_trips = TripSerializer(trips, many=True).data
+def _trip_version(request, trip_id):
+    # Looked up once per request, shared by the ETag/Last-Modified checks and the view
+    if not hasattr(request, "trip_version"):
+        request.trip_version = trip_version(trip_id)
+    return request.trip_version
 
-    return Response(serialized_trips, status=status.HTTP_200_OK)
 
+def _geometry_variant(params):
+    geometry_format, tolerance = parse_geometry_options(params)
+    return f"{geometry_format}-{tolerance:g}"
+
+
+def _trip_etag(request, trip_id):
+    version = _trip_version(request, trip_id)
+    if version is None:
+        return None
+    try:
+        return f"{trip_id}-{version_tag(version)}-{_geometry_variant(request.GET)}"
+    except ValueError:
+        return None
+
+
+def _trip_last_modified(request, trip_id):
+    return _trip_version(request, trip_id)
+
+
+@condition(etag_func=_trip_etag, last_modified_func=_trip_last_modified)
 @api_view(['GET'])
 def get_trip_by_id(request, trip_id):
-    """Retrieve a specific trip by ID, including logs and details."""
+    """
+    Retrieve a specific trip by ID, including logs and details.
+
+    Responses carry an ETag and Last-Modified from the trip's version, so a
+    client polling an unchanged trip gets a 304. Payloads are cached per
+    version until the trip or its logs change.
+    """
     try:
-        trip = Trip.objects.get(id=trip_id)
-    except Trip.DoesNotExist:
+        geometry_options = parse_geometry_options(request.query_params)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    version = _trip_version(request, trip_id)
+    if version is None:
         logger.error(f"Trip {trip_id} not found")
         return Response({"error": "Trip not found"}, status=status.HTTP_404_NOT_FOUND)
 
+    variant = _geometry_variant(request.query_params)
+    response = get_trip_payload(trip_id, version, variant)
+    if response is None:
+        try:
+            response = _trip_details(trip_id, geometry_options)
+        except Trip.DoesNotExist:
+            logger.error(f"Trip {trip_id} not found")
+            return Response({"error": "Trip not found"}, status=status.HTTP_404_NOT_FOUND)
+        set_trip_payload(trip_id, version, variant, response)
+
+    # Let browsers keep the payload but revalidate it (If-None-Match) on every poll
+    return Response(response, status=status.HTTP_200_OK, headers={"Cache-Control": "private, no-cache"})
+
+
+def _trip_details(trip_id, geometry_options):
+    trip = Trip.objects.select_related("route").get(id=trip_id)
     logger.info(f"Fetching details for trip {trip_id}")
 
     trip_data = TripSerializer(trip).data
     logs = Log.objects.filter(trip=trip)
     logs_data = LogSerializer(logs, many=True).data
 
-    return Response({
+    response = {
         "trip": trip_data,
         "logs": logs_data
-    }, status=status.HTTP_200_OK)
+    }
+    # Trips planned before routes were stored have no Route row
+    try:
+        route = trip.route
+    except Route.DoesNotExist:
+        route = None
+    if route is not None:
+        response.update(route_payload(route, list(route.stops.all()), geometry_options))
+    return response
+
+
+@api_view(['POST'])
+def create_driver(request):
+    serializer = DriverSerializer(data=request.data)
+    if serializer.is_valid():
+        serializer.save()
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+@api_view(['GET'])
+def get_driver(request, driver_id):
+    """A driver with their current cycle availability, read from the ledger in one query."""
+    try:
+        driver = Driver.objects.get(id=driver_id)
+    except Driver.DoesNotExist:
+        return Response({"error": "Driver not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    return Response(DriverSerializer(driver).data, status=status.HTTP_200_OK)
+
+
+@api_view(['POST'])
+def dispatch_loads(request):
+    """Assigns trucks to loads, minimizing deadhead miles among HOS-feasible pairs."""
+    serializer = DispatchSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    result = match_loads(serializer.validated_data["trucks"], serializer.validated_data["loads"])
+    return Response(result, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+def get_planning_job(request, job_id):
+    """Reports the status, progress and (once finished) result of a background planning job."""
+    try:
+        job = PlanningJob.objects.get(id=job_id)
+    except PlanningJob.DoesNotExist:
+        return Response({"error": "Job not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    return Response(PlanningJobSerializer(job).data, status=status.HTTP_200_OK)
+
+
+@require_GET
+def metrics_view(request):
+    """Prometheus metrics for this process: request, planning stage, Mapbox and DB histograms."""
+    token = settings.METRICS_TOKEN
+    if token and not constant_time_compare(request.headers.get("Authorization", ""), f"Bearer {token}"):
+        return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+
+    circuits = {(endpoint, state["circuit"]): 1 for endpoint, state in mapbox.latency_stats().items()}
+    body = "\n".join([
+        metrics.render(),
+        metrics.render_gauge("trips_mapbox_circuit_state", "Current Mapbox circuit breaker state per endpoint.",
+                             ("endpoint", "state"), circuits),
+        metrics.render_db_pools(_pool_stats()),
+    ])
+    return HttpResponse(body + "\n", content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def _pool_stats():
+    """get_stats() of each database's psycopg connection pool (databases with DB_POOL on)."""
+    stats = {}
+    for alias in connections:
+        if connections.settings[alias].get("OPTIONS", {}).get("pool"):
+            stats[alias] = connections[alias].pool.get_stats()
+    return stats